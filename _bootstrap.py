@@ -0,0 +1,12 @@
+"""
+Agrega `src/` al sys.path para los scripts de entrada del repositorio.
+
+Al ser un modulo, Python lo ejecuta una sola vez por proceso; los imports
+siguientes lo toman de sys.modules sin repetir el trabajo.
+"""
+import sys
+from pathlib import Path
+
+SRC = Path(__file__).parent / "src"
+if "facturador" not in sys.modules and str(SRC) not in sys.path:
+    sys.path.insert(0, str(SRC))
@@ -3,9 +3,6 @@ from decimal import Decimal
 from pathlib import Path
 from typing import Optional, Sequence
 
-from .processor import process_invoice
-from .pricing import MarkupConfig
-
 # Directorio de facturas (carpeta invoices en la raiz del proyecto).
 DEFAULT_INVOICE_DIR = Path(__file__).resolve().parents[2] / "invoices"
 
@@ -63,11 +60,21 @@ def build_parser() -> argparse.ArgumentParser:
         default="up",
         help="Modo de redondeo para el valor de venta neto (default: up, evita miles cerrados).",
     )
+    parser.add_argument(
+        "--excel-engine",
+        choices=["xlsxwriter", "openpyxl"],
+        default="xlsxwriter",
+        help="Motor para escribir el Excel (default: xlsxwriter; openpyxl como respaldo).",
+    )
     return parser
 
 
 def main(argv: Optional[Sequence[str]] = None) -> None:
     args = build_parser().parse_args(argv)
+    # Imports diferidos: --help y errores de argumentos no cargan lxml/openpyxl/xlsxwriter.
+    from .pricing import MarkupConfig
+    from .processor import process_invoice
+
     DEFAULT_INVOICE_DIR.mkdir(exist_ok=True)
 
     input_path = Path(args.input)
@@ -88,7 +95,14 @@ def main(argv: Optional[Sequence[str]] = None) -> None:
 
     output_path = Path(args.output) if args.output else None
     rules_path = Path(args.rules) if args.rules else None
-    result = process_invoice(input_path, output_path, config, sheet_name=args.sheet, rules_path=rules_path)
+    result = process_invoice(
+        input_path,
+        output_path,
+        config,
+        sheet_name=args.sheet,
+        rules_path=rules_path,
+        excel_engine=args.excel_engine,
+    )
     if result.skipped_existing:
         print(f"No se sobrescribio, archivo existente: {result.output_path}")
     else:
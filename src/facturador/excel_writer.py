@@ -1,29 +1,64 @@
 from decimal import Decimal
-from typing import Iterable, Optional
+from functools import lru_cache
+from typing import Dict, Iterable, Optional
 from openpyxl import Workbook
+from openpyxl.cell import WriteOnlyCell
 from openpyxl.utils import get_column_letter
 
+try:
+    import xlsxwriter
+except ImportError:  # openpyxl queda como motor de respaldo
+    xlsxwriter = None
+
 from .invoice_parser import InvoiceHeader
 from .pricing import MarkupConfig, PriceRow
 
 
-def _excel_round_to_step(expression: str, step: Decimal, mode: str) -> str:
-    if step <= 0:
-        return expression
+EXCEL_ENGINES = ("xlsxwriter", "openpyxl")
+MONEY_FMT = "#,##0.00"
+PERCENT_FMT = "0.00"
+QUANTITY_FMT = "0.00"
+
+PRICE_HEADERS = [
+    "Linea factura",
+    "Producto",
+    "Cantidad",
+    "IVA %",
+    "Costo bruto unitario",
+    "Costo neto unitario",
+    "Venta bruta unitario",
+    "Venta neto unitario",
+    "Valor total Neto compra",
+    "Descuento %",
+]
+
+
+@lru_cache(maxsize=32)
+def _round_to_step_template(step: Decimal, mode: str) -> str:
+    """
+    Plantilla de redondeo a `step` con `%(expr)s` como marcador; se arma una vez por (step, mode).
+    """
     step_str = str(step)
     if mode == "nearest":
-        rounded = f"ROUND(({expression})/{step_str},0)*{step_str}"
+        rounded = f"ROUND((%(expr)s)/{step_str},0)*{step_str}"
     elif mode == "down":
-        rounded = f"FLOOR({expression},{step_str})"
+        rounded = f"FLOOR(%(expr)s,{step_str})"
     else:
-        rounded = f"CEILING({expression},{step_str})"
+        rounded = f"CEILING(%(expr)s,{step_str})"
+    if step % 1000 == 0:
+        # Todo multiplo de step ya es un mil cerrado: el IF siempre sumaria un paso.
+        return f"{rounded}+{step_str}"
     return f"IF(MOD({rounded},1000)=0,{rounded}+{step_str},{rounded})"
 
 
-def _add_header_sheet(wb: Workbook, header: InvoiceHeader) -> None:
-    ws = wb.create_sheet("Encabezado")
-    ws.append(["Campo", "Valor"])
-    rows = [
+def _excel_round_to_step(expression: str, step: Decimal, mode: str) -> str:
+    if step <= 0:
+        return expression
+    return _round_to_step_template(step, mode) % {"expr": expression}
+
+
+def _header_rows(header: InvoiceHeader) -> list:
+    return [
         ("Proveedor", header.supplier_name),
         ("NIT Proveedor", header.supplier_id),
         ("Cliente", header.customer_name),
@@ -37,97 +72,199 @@ def _add_header_sheet(wb: Workbook, header: InvoiceHeader) -> None:
         ("Total con impuestos", header.total_tax_inclusive),
         ("Total factura", header.total),
     ]
-    for label, value in rows:
-        ws.append([label, value])
 
+
+# Formato numerico de las columnas C..J de la hoja de precios.
+_PRICE_COLUMN_FORMATS = (
+    QUANTITY_FMT,  # Cantidad
+    PERCENT_FMT,  # IVA %
+    MONEY_FMT,  # Costo bruto unitario
+    MONEY_FMT,  # Costo neto unitario
+    MONEY_FMT,  # Venta bruta unitario
+    MONEY_FMT,  # Venta neto unitario
+    MONEY_FMT,  # Valor total Neto compra
+    PERCENT_FMT,  # Descuento %
+)
+
+
+def _price_column_width(col_header: str) -> int:
+    return max(len(col_header) + 2, 18)
+
+
+# Plantillas de formula por fila; `%(row)d` se sustituye por el numero de fila de Excel.
+_COSTO_NETO_TEMPLATE = "=ROUND(E%(row)d*(1-J%(row)d/100)*(1+D%(row)d/100),2)"
+_VENTA_BRUTA_TEMPLATE = "=H%(row)d/(1+D%(row)d/100)"
+_TOTAL_NETO_TEMPLATE = "=ROUND(F%(row)d*C%(row)d,2)"
+
+
+def _venta_neta_template(net_raw: str, config: MarkupConfig) -> str:
+    return "=" + _excel_round_to_step(net_raw, config.round_net_step, config.rounding_mode)
+
+
+def _default_venta_neta_template(config: MarkupConfig) -> str:
+    net_raw = f"IF(F%(row)d<{config.threshold},F%(row)d/{config.below_divisor},F%(row)d*{config.above_multiplier})"
+    return _venta_neta_template(net_raw, config)
+
+
+def _price_row_values(
+    idx: int,
+    row: PriceRow,
+    config: MarkupConfig,
+    default_venta_neta: str,
+    markup_templates: Dict[Decimal, str],
+) -> tuple:
+    """
+    Valores de las 10 columnas de una fila de precios, con las formulas ya armadas.
+    `markup_templates` guarda la plantilla de venta neta por % de utilidad durante la exportacion.
+    """
+    values = {"row": idx}
+    markup_percent = row.markup_percent
+    if markup_percent is None:
+        venta_neta_template = default_venta_neta
+    else:
+        venta_neta_template = markup_templates.get(markup_percent)
+        if venta_neta_template is None:
+            venta_neta_template = _venta_neta_template(f"F%(row)d*(1+{markup_percent}/100)", config)
+            markup_templates[markup_percent] = venta_neta_template
+    venta_neta_formula = venta_neta_template % values
+    return (
+        row.source_line_id,
+        row.product,
+        float(row.quantity),
+        float(row.tax_percent),
+        row.cost_bruto_unit,
+        _COSTO_NETO_TEMPLATE % values,
+        _VENTA_BRUTA_TEMPLATE % values,
+        venta_neta_formula,
+        _TOTAL_NETO_TEMPLATE % values,
+        float(row.discount_percent),
+    )
+
+
+def _styled_cell(ws, value, number_format: str) -> WriteOnlyCell:
+    cell = WriteOnlyCell(ws, value=value)
+    cell.number_format = number_format
+    return cell
+
+
+def _add_header_sheet(wb: Workbook, header: InvoiceHeader) -> None:
+    ws = wb.create_sheet("Encabezado")
     ws.column_dimensions["A"].width = 22
     ws.column_dimensions["B"].width = 60
 
-    money_fmt = "#,##0.00"
-    for row in ws.iter_rows(min_row=2, min_col=2, max_col=2):
-        cell = row[0]
-        if isinstance(cell.value, (int, float, Decimal)):
-            cell.number_format = money_fmt
+    ws.append(["Campo", "Valor"])
+    for label, value in _header_rows(header):
+        if isinstance(value, (int, float, Decimal)):
+            value = _styled_cell(ws, value, MONEY_FMT)
+        ws.append([label, value])
 
 
-def export_price_rows(
+def _export_with_openpyxl(
     rows: Iterable[PriceRow],
     output_path: str,
-    sheet_name: str = "Productos",
-    header: Optional[InvoiceHeader] = None,
-    config: Optional[MarkupConfig] = None,
+    sheet_name: str,
+    header: Optional[InvoiceHeader],
+    config: MarkupConfig,
 ) -> None:
-    wb = Workbook()
-    ws = wb.active
-    ws.title = sheet_name
-    config = config or MarkupConfig()
+    # Modo write-only: las filas se escriben en streaming y no se guarda el grafo de celdas en memoria.
+    wb = Workbook(write_only=True)
+    ws = wb.create_sheet(sheet_name)
 
-    headers = [
-        "Linea factura",
-        "Producto",
-        "Cantidad",
-        "IVA %",
-        "Costo bruto unitario",
-        "Costo neto unitario",
-        "Venta bruta unitario",
-        "Venta neto unitario",
-        "Valor total Neto compra",
-        "Descuento %",
-    ]
-    ws.append(headers)
-    money_fmt = "#,##0.00"
-    percent_fmt = "0.00"
+    # En write-only los anchos deben fijarse antes de escribir filas.
+    for col_idx, col_header in enumerate(PRICE_HEADERS, start=1):
+        ws.column_dimensions[get_column_letter(col_idx)].width = _price_column_width(col_header)
+    ws.append(PRICE_HEADERS)
 
+    # write-only serializa cada fila en el append, asi que basta una celda con formato por
+    # columna: se reutiliza cambiando solo el valor en vez de crear y estilizar 8 celdas por fila.
+    formatted_cells = [_styled_cell(ws, None, number_format) for number_format in _PRICE_COLUMN_FORMATS]
+    default_venta_neta = _default_venta_neta_template(config)
+    markup_templates: Dict[Decimal, str] = {}
     for idx, row in enumerate(rows, start=2):
-        excel_row = [
-            row.source_line_id,
-            row.product,
-            float(row.quantity),
-            float(row.tax_percent),
-            row.cost_bruto_unit,
-            None,  # costo neto formula
-            None,  # venta bruta formula
-            None,  # venta neta formula
-            None,  # total neto compra formula
-            float(row.discount_percent),
-        ]
-        ws.append(excel_row)
-        qty_cell = f"C{idx}"
-        iva_cell = f"D{idx}"
-        bruto_cell = f"E{idx}"
-        net_cell = f"F{idx}"
-        venta_bruta_cell = f"G{idx}"
-        venta_neta_cell = f"H{idx}"
-        total_neto_cell = f"I{idx}"
-        desc_cell = f"J{idx}"
-
-        ws.cell(row=idx, column=6).value = f"=ROUND({bruto_cell}*(1-{desc_cell}/100)*(1+{iva_cell}/100),2)"
-
-        if row.markup_percent is not None:
-            net_raw = f"{net_cell}*(1+{row.markup_percent}/100)"
-        else:
-            net_raw = f"IF({net_cell}<{config.threshold},{net_cell}/{config.below_divisor},{net_cell}*{config.above_multiplier})"
-        net_rounded = _excel_round_to_step(net_raw, config.round_net_step, config.rounding_mode)
-        ws.cell(row=idx, column=8).value = f"={net_rounded}"
-
-        ws.cell(row=idx, column=7).value = f"={venta_neta_cell}/(1+{iva_cell}/100)"
-        ws.cell(row=idx, column=9).value = f"=ROUND({net_cell}*{qty_cell},2)"
-
-    for col_idx, col_header in enumerate(headers, start=1):
-        column = get_column_letter(col_idx)
-        ws.column_dimensions[column].width = max(len(col_header) + 2, 18)
-    for row_cells in ws.iter_rows(min_row=2, min_col=3, max_col=10):
-        # Cantidad
-        row_cells[0].number_format = "0.00"
-        # IVA %
-        row_cells[1].number_format = percent_fmt
-        # Costo/Venta columnas + total
-        for cell in row_cells[2:7]:
-            cell.number_format = money_fmt
-        # Descuento %
-        row_cells[7].number_format = percent_fmt
+        values = _price_row_values(idx, row, config, default_venta_neta, markup_templates)
+        for cell, value in zip(formatted_cells, values[2:]):
+            cell.value = value
+        ws.append([values[0], values[1], *formatted_cells])
 
     if header:
         _add_header_sheet(wb, header)
 
     wb.save(str(output_path))
+
+
+def _export_with_xlsxwriter(
+    rows: Iterable[PriceRow],
+    output_path: str,
+    sheet_name: str,
+    header: Optional[InvoiceHeader],
+    config: MarkupConfig,
+) -> None:
+    # constant_memory escribe cada fila a disco al avanzar; las filas deben ir en orden.
+    wb = xlsxwriter.Workbook(str(output_path), {"constant_memory": True, "strings_to_formulas": False})
+    # Los formatos se crean una sola vez por libro, no por celda.
+    money_fmt = wb.add_format({"num_format": MONEY_FMT})
+    percent_fmt = wb.add_format({"num_format": PERCENT_FMT})
+    quantity_fmt = wb.add_format({"num_format": QUANTITY_FMT})
+
+    ws = wb.add_worksheet(sheet_name)
+    for col_idx, col_header in enumerate(PRICE_HEADERS):
+        ws.set_column(col_idx, col_idx, _price_column_width(col_header))
+    ws.write_row(0, 0, PRICE_HEADERS)
+
+    default_venta_neta = _default_venta_neta_template(config)
+    markup_templates: Dict[Decimal, str] = {}
+    for row_idx, row in enumerate(rows, start=1):
+        (
+            line_id,
+            product,
+            quantity,
+            tax_percent,
+            cost_bruto,
+            costo_neto_formula,
+            venta_bruta_formula,
+            venta_neta_formula,
+            total_neto_formula,
+            discount_percent,
+        ) = _price_row_values(row_idx + 1, row, config, default_venta_neta, markup_templates)
+        ws.write_string(row_idx, 0, line_id)
+        ws.write_string(row_idx, 1, product)
+        ws.write_number(row_idx, 2, quantity, quantity_fmt)
+        ws.write_number(row_idx, 3, tax_percent, percent_fmt)
+        ws.write_number(row_idx, 4, cost_bruto, money_fmt)
+        ws.write_formula(row_idx, 5, costo_neto_formula, money_fmt)
+        ws.write_formula(row_idx, 6, venta_bruta_formula, money_fmt)
+        ws.write_formula(row_idx, 7, venta_neta_formula, money_fmt)
+        ws.write_formula(row_idx, 8, total_neto_formula, money_fmt)
+        ws.write_number(row_idx, 9, discount_percent, percent_fmt)
+
+    if header:
+        header_ws = wb.add_worksheet("Encabezado")
+        header_ws.set_column(0, 0, 22)
+        header_ws.set_column(1, 1, 60)
+        header_ws.write_row(0, 0, ["Campo", "Valor"])
+        for row_idx, (label, value) in enumerate(_header_rows(header), start=1):
+            header_ws.write_string(row_idx, 0, label)
+            if isinstance(value, (int, float, Decimal)):
+                header_ws.write_number(row_idx, 1, value, money_fmt)
+            elif value:
+                # Campos vacios quedan como celda en blanco, igual que en openpyxl.
+                header_ws.write_string(row_idx, 1, value)
+
+    wb.close()
+
+
+def export_price_rows(
+    rows: Iterable[PriceRow],
+    output_path: str,
+    sheet_name: str = "Productos",
+    header: Optional[InvoiceHeader] = None,
+    config: Optional[MarkupConfig] = None,
+    engine: str = "xlsxwriter",
+) -> None:
+    if engine not in EXCEL_ENGINES:
+        raise ValueError(f"Motor de Excel no soportado: {engine}")
+    config = config or MarkupConfig()
+    if engine == "xlsxwriter" and xlsxwriter is not None:
+        _export_with_xlsxwriter(rows, output_path, sheet_name, header, config)
+    else:
+        _export_with_openpyxl(rows, output_path, sheet_name, header, config)
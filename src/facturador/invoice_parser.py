@@ -1,7 +1,11 @@
-from dataclasses import dataclass
+from dataclasses import dataclass, field
 from decimal import Decimal
-import xml.etree.ElementTree as ET
-from typing import List
+from functools import lru_cache
+import io
+import threading
+from typing import BinaryIO, Iterable, Iterator, List, Optional
+
+from lxml import etree
 
 
 OUTER_NS = {
@@ -19,8 +23,120 @@ SUPPORTED_ROOTS = {
     "CreditNote": "PURCHASE_CREDIT_NOTE",
 }
 
+# Sin entidades externas ni red (evita XXE) y sin tabla de IDs, que nunca se consulta.
+_PARSER_OPTIONS = {
+    "remove_blank_text": True,
+    "resolve_entities": False,
+    "no_network": True,
+    "collect_ids": False,
+    "huge_tree": True,
+}
+# Un parser compartido entre hilos serializa el parseo; el servicio Flask corre con varios hilos.
+_THREAD_PARSERS = threading.local()
+
 
-@dataclass
+def _parsers() -> tuple:
+    """
+    Devuelve (parser, parser_embebido) del hilo actual, creandolos la primera vez.
+    """
+    parsers = getattr(_THREAD_PARSERS, "parsers", None)
+    if parsers is None:
+        parsers = (
+            etree.XMLParser(**_PARSER_OPTIONS),
+            # El XML embebido llega como texto ya decodificado; se fuerza UTF-8 al re-codificarlo.
+            etree.XMLParser(encoding="utf-8", **_PARSER_OPTIONS),
+        )
+        _THREAD_PARSERS.parsers = parsers
+    return parsers
+
+
+def _xpath(path: str) -> etree.XPath:
+    return etree.XPath(path, namespaces=INVOICE_NS, smart_strings=False)
+
+
+def _text_xpath(path: str) -> etree.XPath:
+    return _xpath(f"string({path})")
+
+
+_DESCRIPTION_TAG = f"{{{OUTER_NS['cbc']}}}Description"
+_EXTERNAL_REFERENCE_TAG = f"{{{OUTER_NS['cac']}}}ExternalReference"
+_ATTACHMENT_TAG = f"{{{OUTER_NS['cac']}}}Attachment"
+# Eventos que interesan al recorrer el AttachedDocument: la raiz (si ya es Invoice/CreditNote)
+# y los cbc:Description donde viaja el XML embebido.
+_SCAN_TAGS = ("{*}Invoice", "{*}CreditNote", _DESCRIPTION_TAG)
+
+# En UBL las lineas son hijas directas de la raiz; el eje descendiente queda como respaldo.
+_INVOICE_LINE_XPATH = _xpath("cac:InvoiceLine")
+_CREDIT_NOTE_LINE_XPATH = _xpath("cac:CreditNoteLine")
+_NESTED_INVOICE_LINE_XPATH = _xpath(".//cac:InvoiceLine")
+_NESTED_CREDIT_NOTE_LINE_XPATH = _xpath(".//cac:CreditNoteLine")
+_LINE_ID_XPATH = _text_xpath("cbc:ID")
+_LINE_DESCRIPTION_XPATH = _text_xpath("cac:Item/cbc:Description")
+_SELLERS_ITEM_ID_XPATH = _text_xpath("cac:Item/cac:SellersItemIdentification/cbc:ID")
+_STANDARD_ITEM_ID_XPATH = _text_xpath("cac:Item/cac:StandardItemIdentification/cbc:ID")
+_INVOICED_QUANTITY_XPATH = _text_xpath("cbc:InvoicedQuantity")
+_CREDITED_QUANTITY_XPATH = _text_xpath("cbc:CreditedQuantity")
+_LINE_EXTENSION_XPATH = _text_xpath("cbc:LineExtensionAmount")
+_LINE_TAX_PERCENT_XPATH = _text_xpath(".//cac:TaxCategory/cbc:Percent")
+
+_ALLOWANCE_CHARGE_XPATH = _xpath("cac:AllowanceCharge")
+# Campos de cac:AllowanceCharge que se leen en una sola pasada por sus hijos (tag -> posicion).
+_ALLOWANCE_FIELDS = {
+    f"{{{INVOICE_NS['cbc']}}}ChargeIndicator": 0,
+    f"{{{INVOICE_NS['cbc']}}}MultiplierFactorNumeric": 1,
+    f"{{{INVOICE_NS['cbc']}}}Amount": 2,
+    f"{{{INVOICE_NS['cbc']}}}BaseAmount": 3,
+}
+
+_SUBTOTAL_XPATH = _text_xpath("cac:LegalMonetaryTotal/cbc:LineExtensionAmount")
+_TAX_INCLUSIVE_XPATH = _text_xpath("cac:LegalMonetaryTotal/cbc:TaxInclusiveAmount")
+_PAYABLE_XPATH = _text_xpath("cac:LegalMonetaryTotal/cbc:PayableAmount")
+_TAX_TOTAL_XPATH = _xpath("cac:TaxTotal")
+_TAX_AMOUNT_XPATH = _text_xpath("cbc:TaxAmount")
+
+
+def _text_xpaths(paths: List[str]) -> List[etree.XPath]:
+    return [_text_xpath(path) for path in paths]
+
+
+_SUPPLIER_NAME_XPATHS = _text_xpaths(
+    [
+        "cac:AccountingSupplierParty/cac:Party/cac:PartyTaxScheme/cbc:RegistrationName",
+        "cac:AccountingSupplierParty/cac:Party/cac:PartyLegalEntity/cbc:RegistrationName",
+        "cac:AccountingSupplierParty/cac:Party/cac:PartyName/cbc:Name",
+    ]
+)
+_SUPPLIER_ID_XPATHS = _text_xpaths(
+    [
+        "cac:AccountingSupplierParty/cac:Party/cac:PartyTaxScheme/cbc:CompanyID",
+        "cac:AccountingSupplierParty/cac:Party/cac:PartyLegalEntity/cbc:CompanyID",
+    ]
+)
+_CUSTOMER_NAME_XPATHS = _text_xpaths(
+    [
+        "cac:AccountingCustomerParty/cac:Party/cac:PartyTaxScheme/cbc:RegistrationName",
+        "cac:AccountingCustomerParty/cac:Party/cac:PartyName/cbc:Name",
+    ]
+)
+_INVOICE_ID_XPATHS = _text_xpaths(["cbc:ID"])
+_CUFE_XPATHS = _text_xpaths(["cbc:UUID"])
+_ISSUE_DATE_XPATHS = _text_xpaths(["cbc:IssueDate"])
+_DUE_DATE_XPATHS = _text_xpaths(["cbc:DueDate"])
+_CURRENCY_XPATHS = _text_xpaths(["cbc:DocumentCurrencyCode"])
+_REFERENCE_INVOICE_XPATHS = _text_xpaths(
+    [
+        "cac:BillingReference/cac:InvoiceDocumentReference/cbc:ID",
+        "cac:DiscrepancyResponse/cbc:ReferenceID",
+    ]
+)
+_REFERENCE_CUFE_XPATHS = _text_xpaths(
+    [
+        "cac:BillingReference/cac:InvoiceDocumentReference/cbc:UUID",
+    ]
+)
+
+
+@dataclass(slots=True)
 class InvoiceLine:
     line_id: str
     description: str
@@ -33,6 +149,92 @@ class InvoiceLine:
 
 
 @dataclass
+class InvoiceLineBatch:
+    """
+    Lineas de factura en columnas paralelas (una lista por campo), sin un objeto por linea.
+    """
+    line_ids: List[str] = field(default_factory=list)
+    descriptions: List[str] = field(default_factory=list)
+    supplier_references: List[str] = field(default_factory=list)
+    quantities: List[Decimal] = field(default_factory=list)
+    line_extension_amounts: List[Decimal] = field(default_factory=list)
+    tax_percents: List[Decimal] = field(default_factory=list)
+    base_amounts: List[Decimal] = field(default_factory=list)
+    discount_percents: List[Decimal] = field(default_factory=list)
+
+    @classmethod
+    def from_lines(cls, lines: Iterable[InvoiceLine]) -> "InvoiceLineBatch":
+        batch = cls()
+        for line in lines:
+            batch.append(
+                line.line_id,
+                line.description,
+                line.supplier_reference,
+                line.quantity,
+                line.line_extension_amount,
+                line.tax_percent,
+                line.base_amount,
+                line.discount_percent,
+            )
+        return batch
+
+    def append(
+        self,
+        line_id: str,
+        description: str,
+        supplier_reference: str,
+        quantity: Decimal,
+        line_extension_amount: Decimal,
+        tax_percent: Decimal,
+        base_amount: Decimal,
+        discount_percent: Decimal,
+    ) -> None:
+        self.line_ids.append(line_id)
+        self.descriptions.append(description)
+        self.supplier_references.append(supplier_reference)
+        self.quantities.append(quantity)
+        self.line_extension_amounts.append(line_extension_amount)
+        self.tax_percents.append(tax_percent)
+        self.base_amounts.append(base_amount)
+        self.discount_percents.append(discount_percent)
+
+    def rows(self) -> Iterator[tuple]:
+        """
+        Recorre las columnas en paralelo, en el mismo orden de campos que InvoiceLine.
+        """
+        return zip(
+            self.line_ids,
+            self.descriptions,
+            self.supplier_references,
+            self.quantities,
+            self.line_extension_amounts,
+            self.tax_percents,
+            self.base_amounts,
+            self.discount_percents,
+        )
+
+    def __len__(self) -> int:
+        return len(self.line_ids)
+
+    def __getitem__(self, index: int) -> InvoiceLine:
+        return InvoiceLine(
+            line_id=self.line_ids[index],
+            description=self.descriptions[index],
+            supplier_reference=self.supplier_references[index],
+            quantity=self.quantities[index],
+            line_extension_amount=self.line_extension_amounts[index],
+            tax_percent=self.tax_percents[index],
+            base_amount=self.base_amounts[index],
+            discount_percent=self.discount_percents[index],
+        )
+
+    def __iter__(self) -> Iterator[InvoiceLine]:
+        # Compatibilidad con codigo que espera objetos InvoiceLine.
+        for values in self.rows():
+            yield InvoiceLine(*values)
+
+
+@dataclass(slots=True)
 class InvoiceHeader:
     supplier_name: str
     supplier_id: str
@@ -51,11 +253,38 @@ class InvoiceHeader:
     reference_cufe: str = ""
 
 
-def _to_decimal(value: str, default: str = "0") -> Decimal:
+_D0 = Decimal("0")
+_D1 = Decimal("1")
+_D100 = Decimal("100")
+_D001 = Decimal("0.01")
+
+
+@lru_cache(maxsize=4096)
+def _parse_decimal(value: str) -> Decimal:
+    # Las facturas repiten pocos valores ("0", "19.00", "1"); Decimal es inmutable y se puede compartir.
+    return Decimal(value)
+
+
+def _to_decimal(value: Optional[str], default: Decimal = _D0) -> Decimal:
+    if not value:
+        return default
     try:
-        return Decimal(value)
+        return _parse_decimal(value)
     except Exception:
-        return Decimal(default)
+        return default
+
+
+def _allowance_values(allowance: etree._Element) -> List[str]:
+    """
+    Devuelve [ChargeIndicator, MultiplierFactorNumeric, Amount, BaseAmount] recorriendo los hijos una vez.
+    Como con string() en XPath, gana la primera aparicion de cada campo y los ausentes quedan en "".
+    """
+    values: List[Optional[str]] = [None, None, None, None]
+    for child in allowance:
+        position = _ALLOWANCE_FIELDS.get(child.tag)
+        if position is not None and values[position] is None:
+            values[position] = child.text or ""
+    return [value or "" for value in values]
 
 
 def _local_name(tag: str) -> str:
@@ -64,82 +293,118 @@ def _local_name(tag: str) -> str:
     return tag
 
 
-def _document_kind_from_root(root: ET.Element) -> str:
+def _document_kind_from_root(root: etree._Element) -> str:
     return SUPPORTED_ROOTS.get(_local_name(root.tag), "")
 
-def _is_invoice_root(root: ET.Element) -> bool:
+def _is_invoice_root(root: etree._Element) -> bool:
     return bool(_document_kind_from_root(root))
 
 
-def _extract_invoice_root_from_attached(root: ET.Element) -> ET.Element:
-    for desc in root.findall(".//cac:Attachment/cac:ExternalReference/cbc:Description", OUTER_NS):
-        payload = desc.text
-        if not payload or ("<Invoice" not in payload and "<CreditNote" not in payload):
+def _is_attachment_description(elem: etree._Element) -> bool:
+    parent = elem.getparent()
+    if parent is None or parent.tag != _EXTERNAL_REFERENCE_TAG:
+        return False
+    grandparent = parent.getparent()
+    return grandparent is not None and grandparent.tag == _ATTACHMENT_TAG
+
+
+def _parse_embedded_invoice(payload: str):
+    if "<Invoice" not in payload and "<CreditNote" not in payload:
+        return None
+    try:
+        embedded = etree.fromstring(payload.encode("utf-8"), _parsers()[1])
+    except etree.XMLSyntaxError:
+        return None
+    return embedded if _is_invoice_root(embedded) else None
+
+
+def _extract_invoice_root_from_stream(source: BinaryIO) -> etree._Element:
+    """
+    Recorre el XML en streaming: si la raiz ya es Invoice/CreditNote la parsea completa; si es un
+    AttachedDocument solo materializa los cbc:Description y libera el resto del envoltorio.
+    """
+    context = etree.iterparse(
+        source,
+        events=("start", "end"),
+        tag=_SCAN_TAGS,
+        **_PARSER_OPTIONS,
+    )
+    for event, elem in context:
+        if event == "start":
+            if elem.getparent() is None and _is_invoice_root(elem):
+                source.seek(0)
+                return etree.parse(source, _parsers()[0]).getroot()
             continue
-        try:
-            embedded = ET.fromstring(payload)
-            if _is_invoice_root(embedded):
-                return embedded
-        except ET.ParseError:
+        if elem.tag != _DESCRIPTION_TAG:
             continue
+        if elem.text and _is_attachment_description(elem):
+            embedded = _parse_embedded_invoice(elem.text)
+            if embedded is not None:
+                return embedded
+        elem.clear(keep_tail=True)
+        while elem.getprevious() is not None:
+            del elem.getparent()[0]
     raise ValueError("No se encontro un XML de Invoice o CreditNote embebido en el archivo.")
 
 
-def extract_invoice_root_from_bytes(data: bytes) -> ET.Element:
-    root = ET.fromstring(data)
-    if _is_invoice_root(root):
-        return root
-    return _extract_invoice_root_from_attached(root)
+def extract_invoice_root_from_bytes(data: bytes) -> etree._Element:
+    """
+    Igual que extract_invoice_root, para XML que ya esta en memoria (adjuntos de correo).
+    """
+    return _extract_invoice_root_from_stream(io.BytesIO(data))
 
 
-def extract_invoice_root(path: str) -> ET.Element:
+def extract_invoice_root(path: str) -> etree._Element:
     """
     Busca el primer bloque <Invoice> embebido en los cbc:Description del AttachedDocument.
+    El archivo se lee en streaming, sin cargarlo completo en memoria.
     """
     with open(path, "rb") as handle:
-        data = handle.read()
-    return extract_invoice_root_from_bytes(data)
+        return _extract_invoice_root_from_stream(handle)
 
 
-def parse_invoice_lines(invoice_root: ET.Element) -> List[InvoiceLine]:
+def parse_invoice_lines(invoice_root: etree._Element) -> List[InvoiceLine]:
     """
     Convierte las cac:InvoiceLine en objetos InvoiceLine con decimales.
     """
-    lines: List[InvoiceLine] = []
+    return list(parse_invoice_line_batch(invoice_root))
+
+
+def parse_invoice_line_batch(invoice_root: etree._Element) -> InvoiceLineBatch:
+    """
+    Convierte las cac:InvoiceLine en un InvoiceLineBatch con decimales.
+    """
+    batch = InvoiceLineBatch()
     root_name = _local_name(invoice_root.tag)
-    line_tag = ".//cac:CreditNoteLine" if root_name == "CreditNote" else ".//cac:InvoiceLine"
-    quantity_tag = "cbc:CreditedQuantity" if root_name == "CreditNote" else "cbc:InvoicedQuantity"
-
-    for node in invoice_root.findall(line_tag, INVOICE_NS):
-        line_id = (node.findtext("cbc:ID", namespaces=INVOICE_NS) or "").strip()
-        description = (node.findtext("cac:Item/cbc:Description", namespaces=INVOICE_NS) or "").strip()
-        supplier_reference = (
-            node.findtext("cac:Item/cac:SellersItemIdentification/cbc:ID", namespaces=INVOICE_NS)
-            or node.findtext("cac:Item/cac:StandardItemIdentification/cbc:ID", namespaces=INVOICE_NS)
-            or ""
-        ).strip()
-        quantity = _to_decimal(node.findtext(quantity_tag, namespaces=INVOICE_NS) or "0")
-        line_extension = _to_decimal(node.findtext("cbc:LineExtensionAmount", namespaces=INVOICE_NS) or "0")
-        tax_percent = _to_decimal(
-            node.findtext(".//cac:TaxCategory/cbc:Percent", namespaces=INVOICE_NS) or "0"
-        )
+    if root_name == "CreditNote":
+        line_xpath, nested_xpath = _CREDIT_NOTE_LINE_XPATH, _NESTED_CREDIT_NOTE_LINE_XPATH
+        quantity_xpath = _CREDITED_QUANTITY_XPATH
+    else:
+        line_xpath, nested_xpath = _INVOICE_LINE_XPATH, _NESTED_INVOICE_LINE_XPATH
+        quantity_xpath = _INVOICED_QUANTITY_XPATH
+    line_nodes = line_xpath(invoice_root) or nested_xpath(invoice_root)
+
+    for node in line_nodes:
+        line_id = _LINE_ID_XPATH(node).strip()
+        description = _LINE_DESCRIPTION_XPATH(node).strip()
+        supplier_reference = (_SELLERS_ITEM_ID_XPATH(node) or _STANDARD_ITEM_ID_XPATH(node)).strip()
+        quantity = _to_decimal(quantity_xpath(node))
+        line_extension = _to_decimal(_LINE_EXTENSION_XPATH(node))
+        tax_percent = _to_decimal(_LINE_TAX_PERCENT_XPATH(node))
 
         # Descuentos: sumamos los Multipliers y los Amount de AllowanceCharge con ChargeIndicator = false
-        discount_percent = Decimal("0")
-        allowance_total = Decimal("0")
+        discount_percent = _D0
+        allowance_total = _D0
         base_amount_candidates: List[Decimal] = []
-        multiplier_sum = Decimal("0")
-        for allowance in node.findall("cac:AllowanceCharge", INVOICE_NS):
-            charge_indicator = allowance.findtext("cbc:ChargeIndicator", namespaces=INVOICE_NS) or ""
+        multiplier_sum = _D0
+        for allowance in _ALLOWANCE_CHARGE_XPATH(node):
+            charge_indicator, disc_pct, amount, base = _allowance_values(allowance)
             if charge_indicator.lower() == "true":
                 continue
-            disc_pct = allowance.findtext("cbc:MultiplierFactorNumeric", namespaces=INVOICE_NS)
             if disc_pct:
                 multiplier_sum += _to_decimal(disc_pct)
-            amount = allowance.findtext("cbc:Amount", namespaces=INVOICE_NS)
             if amount:
                 allowance_total += _to_decimal(amount)
-            base = allowance.findtext("cbc:BaseAmount", namespaces=INVOICE_NS)
             if base:
                 base_amount_candidates.append(_to_decimal(base))
 
@@ -148,8 +413,8 @@ def parse_invoice_lines(invoice_root: ET.Element) -> List[InvoiceLine]:
             base_amount = base_amount_raw
             if quantity > 0 and base_amount_raw < line_extension and base_amount_raw * quantity >= line_extension:
                 base_amount = base_amount_raw * quantity
-        elif multiplier_sum > 0 and line_extension > 0 and multiplier_sum < Decimal("100"):
-            base_amount = line_extension / (Decimal("1") - (multiplier_sum / Decimal("100")))
+        elif multiplier_sum > 0 and line_extension > 0 and multiplier_sum < _D100:
+            base_amount = line_extension / (_D1 - multiplier_sum * _D001)
         else:
             base_amount = line_extension + allowance_total if allowance_total else line_extension
 
@@ -158,96 +423,58 @@ def parse_invoice_lines(invoice_root: ET.Element) -> List[InvoiceLine]:
         # 2) Si solo hay multiplicador, usarlo.
         # 3) Si hay monto de descuento, usar monto/base.
         if base_amount > 0 and line_extension > 0 and line_extension <= base_amount:
-            discount_percent = (Decimal("1") - (line_extension / base_amount)) * Decimal("100")
+            discount_percent = (_D1 - (line_extension / base_amount)) * _D100
         elif multiplier_sum > 0:
             discount_percent = multiplier_sum
         elif base_amount > 0 and allowance_total > 0:
-            discount_percent = (allowance_total / base_amount) * Decimal("100")
+            discount_percent = (allowance_total / base_amount) * _D100
 
         if discount_percent < 0:
-            discount_percent = Decimal("0")
-
-        lines.append(
-            InvoiceLine(
-                line_id=line_id,
-                description=description,
-                supplier_reference=supplier_reference,
-                quantity=quantity,
-                line_extension_amount=line_extension,
-                tax_percent=tax_percent,
-                base_amount=base_amount,
-                discount_percent=discount_percent,
-            )
+            discount_percent = _D0
+
+        batch.append(
+            line_id,
+            description,
+            supplier_reference,
+            quantity,
+            line_extension,
+            tax_percent,
+            base_amount,
+            discount_percent,
         )
-    if not lines:
+    if not batch:
         raise ValueError("El documento no contiene lineas de items.")
-    return lines
+    return batch
 
 
-def _first_text(node: ET.Element, paths: List[str]) -> str:
-    for path in paths:
-        value = node.findtext(path, namespaces=INVOICE_NS)
+def _first_text(node: etree._Element, xpaths: List[etree.XPath]) -> str:
+    for xpath in xpaths:
+        value = xpath(node)
         if value:
             return value.strip()
     return ""
 
 
-def parse_invoice_header(invoice_root: ET.Element) -> InvoiceHeader:
+def parse_invoice_header(invoice_root: etree._Element) -> InvoiceHeader:
     document_kind = _document_kind_from_root(invoice_root) or "PURCHASE_INVOICE"
-    supplier_name = _first_text(
-        invoice_root,
-        [
-            "cac:AccountingSupplierParty/cac:Party/cac:PartyTaxScheme/cbc:RegistrationName",
-            "cac:AccountingSupplierParty/cac:Party/cac:PartyLegalEntity/cbc:RegistrationName",
-            "cac:AccountingSupplierParty/cac:Party/cac:PartyName/cbc:Name",
-        ],
-    )
-    supplier_id = _first_text(
-        invoice_root,
-        [
-            "cac:AccountingSupplierParty/cac:Party/cac:PartyTaxScheme/cbc:CompanyID",
-            "cac:AccountingSupplierParty/cac:Party/cac:PartyLegalEntity/cbc:CompanyID",
-        ],
-    )
-    customer_name = _first_text(
-        invoice_root,
-        [
-            "cac:AccountingCustomerParty/cac:Party/cac:PartyTaxScheme/cbc:RegistrationName",
-            "cac:AccountingCustomerParty/cac:Party/cac:PartyName/cbc:Name",
-        ],
-    )
-    invoice_id = _first_text(invoice_root, ["cbc:ID"])
-    cufe = _first_text(invoice_root, ["cbc:UUID"])
-    issue_date = _first_text(invoice_root, ["cbc:IssueDate"])
-    due_date = _first_text(invoice_root, ["cbc:DueDate"])
-    currency = _first_text(invoice_root, ["cbc:DocumentCurrencyCode"])
-
-    subtotal = _to_decimal(
-        invoice_root.findtext("cac:LegalMonetaryTotal/cbc:LineExtensionAmount", namespaces=INVOICE_NS) or "0"
-    )
-    total_tax_inclusive = _to_decimal(
-        invoice_root.findtext("cac:LegalMonetaryTotal/cbc:TaxInclusiveAmount", namespaces=INVOICE_NS) or "0"
-    )
-    total = _to_decimal(
-        invoice_root.findtext("cac:LegalMonetaryTotal/cbc:PayableAmount", namespaces=INVOICE_NS) or "0"
-    )
-    tax_total = Decimal("0")
-    for tax in invoice_root.findall("cac:TaxTotal", INVOICE_NS):
-        tax_total += _to_decimal(tax.findtext("cbc:TaxAmount", namespaces=INVOICE_NS) or "0")
-
-    reference_invoice_number = _first_text(
-        invoice_root,
-        [
-            "cac:BillingReference/cac:InvoiceDocumentReference/cbc:ID",
-            "cac:DiscrepancyResponse/cbc:ReferenceID",
-        ],
-    )
-    reference_cufe = _first_text(
-        invoice_root,
-        [
-            "cac:BillingReference/cac:InvoiceDocumentReference/cbc:UUID",
-        ],
-    )
+    supplier_name = _first_text(invoice_root, _SUPPLIER_NAME_XPATHS)
+    supplier_id = _first_text(invoice_root, _SUPPLIER_ID_XPATHS)
+    customer_name = _first_text(invoice_root, _CUSTOMER_NAME_XPATHS)
+    invoice_id = _first_text(invoice_root, _INVOICE_ID_XPATHS)
+    cufe = _first_text(invoice_root, _CUFE_XPATHS)
+    issue_date = _first_text(invoice_root, _ISSUE_DATE_XPATHS)
+    due_date = _first_text(invoice_root, _DUE_DATE_XPATHS)
+    currency = _first_text(invoice_root, _CURRENCY_XPATHS)
+
+    subtotal = _to_decimal(_SUBTOTAL_XPATH(invoice_root))
+    total_tax_inclusive = _to_decimal(_TAX_INCLUSIVE_XPATH(invoice_root))
+    total = _to_decimal(_PAYABLE_XPATH(invoice_root))
+    tax_total = _D0
+    for tax in _TAX_TOTAL_XPATH(invoice_root):
+        tax_total += _to_decimal(_TAX_AMOUNT_XPATH(tax))
+
+    reference_invoice_number = _first_text(invoice_root, _REFERENCE_INVOICE_XPATHS)
+    reference_cufe = _first_text(invoice_root, _REFERENCE_CUFE_XPATHS)
 
     return InvoiceHeader(
         supplier_name=supplier_name,
@@ -1,27 +1,39 @@
 import base64
+from collections import deque
 from concurrent.futures import ThreadPoolExecutor, as_completed
 from dataclasses import dataclass, field
 from decimal import Decimal
+from functools import lru_cache, partial
 import io
 import json
 import logging
+import mimetypes
 import os
 from pathlib import Path
+import random
+import re
 import socket
 import ssl
 import sys
 import threading
 import time
 from typing import Optional
-import urllib.error
+import urllib.parse
 import urllib.request
 import zipfile
 
 from googleapiclient.errors import HttpError
+from googleapiclient.model import JsonModel
+import urllib3
+
+try:
+    import orjson
+except ImportError:  # json de la stdlib (JsonModel por defecto) queda como respaldo
+    orjson = None
 
 from .invoice_parser import extract_invoice_root_from_bytes, parse_invoice_header
 from .pricing import MarkupConfig
-from .processor import ProcessResult, process_invoice_bytes
+from .processor import ProcessResult, _safe_name as _processor_safe_name, process_invoice_bytes
 
 
 LOGGER = logging.getLogger(__name__)
@@ -42,7 +54,7 @@ class OAuthTokenInvalidError(AutomationError):
         self.reason = reason
 
 
-@dataclass
+@dataclass(slots=True)
 class MailAutomationConfig:
     gmail_query: str = "has:attachment filename:zip in:inbox"
     processed_label_name: str = "facturador-procesado"
@@ -179,6 +191,7 @@ class FirestoreOAuthTokenStore:
         )
 
 
+@lru_cache(maxsize=1)
 def _app_base_dir() -> Path:
     if getattr(sys, "frozen", False):
         return Path(sys.executable).resolve().parent
@@ -197,6 +210,19 @@ def _resolve_optional_path(base: Path, raw_value: Optional[str]) -> Optional[Pat
     return base / path
 
 
+def _loads_json_bytes(data: bytes):
+    """
+    Parsea JSON desde bytes con orjson si esta disponible. Si orjson lo rechaza (p. ej. un BOM UTF-8
+    agregado por el Bloc de notas), se reintenta con json de la stdlib, que conserva el mensaje de error.
+    """
+    if orjson is not None:
+        try:
+            return orjson.loads(data)
+        except orjson.JSONDecodeError:
+            pass
+    return json.loads(data)
+
+
 def default_mail_automation_config_path() -> Path:
     return _app_base_dir() / "config" / "mail_automation.json"
 
@@ -225,7 +251,7 @@ def load_mail_automation_config(path: Optional[Path] = None) -> MailAutomationCo
         )
 
     try:
-        payload = json.loads(cfg_path.read_text(encoding="utf-8"))
+        payload = _loads_json_bytes(cfg_path.read_bytes())
     except Exception as exc:
         raise AutomationError(f"No se pudo leer {cfg_path}: {exc}") from exc
 
@@ -296,19 +322,21 @@ def load_mail_automation_config(path: Optional[Path] = None) -> MailAutomationCo
     return cfg
 
 
+@lru_cache(maxsize=1)
 def _import_google_deps():
+    # Se resuelve una sola vez: _upload_drive_file lo llama por cada archivo subido.
     try:
         from google.auth.transport.requests import Request
         from google.oauth2.credentials import Credentials
         from google_auth_oauthlib.flow import InstalledAppFlow
         from googleapiclient.discovery import build
-        from googleapiclient.http import MediaFileUpload
+        from googleapiclient.http import MediaFileUpload, MediaIoBaseUpload
     except ImportError as exc:
         raise AutomationError(
             "Faltan dependencias de Google.\n"
             "Ejecuta: pip install -r requirements.txt"
         ) from exc
-    return Request, Credentials, InstalledAppFlow, build, MediaFileUpload
+    return Request, Credentials, InstalledAppFlow, build, MediaFileUpload, MediaIoBaseUpload
 
 
 def _import_google_storage_dep():
@@ -333,11 +361,28 @@ def _import_google_firestore_dep():
     return firestore
 
 
-def _safe_name(value: str) -> str:
-    invalid = '<>:"/\\\\|?*'
-    cleaned = "".join("_" if ch in invalid or ord(ch) < 32 else ch for ch in value)
-    cleaned = cleaned.strip().strip(".")
-    return cleaned or "archivo"
+class _OrjsonModel(JsonModel):
+    """
+    JsonModel de googleapiclient que deserializa las respuestas con orjson; las mas pesadas
+    son messages.get (arbol MIME) y attachments.get (ZIP en base64).
+    """
+
+    def deserialize(self, content):
+        try:
+            body = orjson.loads(content)
+        except orjson.JSONDecodeError:
+            return super().deserialize(content)
+        if self._data_wrapper and isinstance(body, dict) and "data" in body:
+            body = body["data"]
+        return body
+
+
+def _google_json_model() -> Optional[JsonModel]:
+    return _OrjsonModel() if orjson is not None else None
+
+
+# Misma limpieza de nombres que processor; en el correo el nombre por defecto es "archivo".
+_safe_name = partial(_processor_safe_name, fallback="archivo")
 
 
 def _message_subject(message_payload: dict) -> str:
@@ -353,18 +398,141 @@ def _gmail_label_query(label_name: str) -> str:
     return f'label:"{escaped}"'
 
 
+def _message_part_fields(depth: int) -> str:
+    # El nivel mas profundo solo pide parts/partId: si viene, el arbol MIME quedo truncado por la mascara.
+    fields = "filename,body/attachmentId,parts/partId"
+    for _ in range(depth):
+        fields = f"filename,body/attachmentId,parts({fields})"
+    return fields
+
+
+# Niveles de partes MIME anidadas que cubre la respuesta parcial de messages.get.
+GMAIL_MESSAGE_PART_DEPTH = 6
+# Respuesta parcial de messages.get: Subject y, del arbol MIME, solo filename y attachmentId.
+# Se omite body.data, que en format=full trae inline el texto/HTML de cada parte.
+GMAIL_MESSAGE_FIELDS = f"id,payload(headers(name,value),{_message_part_fields(GMAIL_MESSAGE_PART_DEPTH)})"
+# Gmail acepta hasta 100 llamadas por lote; con mas de 50 empieza a responder 429 por rafaga.
+GMAIL_BATCH_SIZE = 50
+# Maximo de ids por llamada a messages.batchModify.
+GMAIL_BATCH_MODIFY_LIMIT = 1000
+# Subidas simultaneas a Drive por carpeta de factura.
+DRIVE_UPLOAD_WORKERS = 4
+# Conexiones simultaneas al ERP (run_once puede procesar mensajes en paralelo).
+ERP_HTTP_POOL_SIZE = 4
+# Mismo limite que urllib.request.HTTPRedirectHandler.max_redirections.
+ERP_MAX_REDIRECTS = 10
+_REDIRECT_TO_GET_STATUS = frozenset({301, 302, 303})
+# Por debajo de este tamano el archivo se sube desde memoria en una sola peticion.
+DRIVE_INLINE_UPLOAD_MAX_BYTES = 5 * 1024 * 1024
+# Ids de etiquetas Gmail ya resueltos; evita labels.list en cada arranque (--once por cron).
+GMAIL_LABEL_STATE_FILE = ".gmail_labels.json"
+
+
+def _has_inline_zip_part(message_payload: dict) -> bool:
+    for part in _iter_parts(message_payload.get("payload") or {}):
+        filename = str(part.get("filename", "")).strip()
+        if filename.lower().endswith(".zip") and not (part.get("body") or {}).get("attachmentId"):
+            return True
+    return False
+
+
+def _message_parts_truncated(message_payload: dict) -> bool:
+    """
+    True si alguna parte supera GMAIL_MESSAGE_PART_DEPTH niveles: sus adjuntos no vinieron en la
+    respuesta parcial y hay que pedir el mensaje completo.
+    """
+    pending = deque(((message_payload.get("payload") or {}, 0),))
+    while pending:
+        part, depth = pending.popleft()
+        if depth > GMAIL_MESSAGE_PART_DEPTH:
+            return True
+        for child in part.get("parts") or ():
+            pending.append((child, depth + 1))
+    return False
+
+
 def _iter_parts(payload: dict):
-    stack = [payload]
-    while stack:
-        part = stack.pop()
+    # Recorrido por niveles: los adjuntos salen en el orden en que aparecen en el mensaje.
+    pending = deque((payload,))
+    while pending:
+        part = pending.popleft()
         yield part
-        child_parts = part.get("parts") or []
-        for child in child_parts:
-            stack.append(child)
+        child_parts = part.get("parts")
+        if child_parts:
+            pending.extend(child_parts)
+
+
+# Bloque de decodificacion base64 (multiplo de 4 caracteres).
+_BASE64_CHUNK_CHARS = 4 * 1024 * 1024
+
+
+def _decode_base64url(encoded: str) -> bytes:
+    """
+    Decodifica base64url por bloques hacia un BytesIO: urlsafe_b64decode sobre todo el texto crea dos
+    copias completas (ASCII y traducida) antes del resultado. Con un ZIP de 20 MiB el pico baja de
+    ~53 MiB a ~24 MiB.
+    """
+    if len(encoded) <= _BASE64_CHUNK_CHARS:
+        return base64.urlsafe_b64decode(encoded)
+    decoded = io.BytesIO()
+    try:
+        for start in range(0, len(encoded), _BASE64_CHUNK_CHARS):
+            decoded.write(base64.urlsafe_b64decode(encoded[start : start + _BASE64_CHUNK_CHARS]))
+    except ValueError:
+        # Texto con saltos de linea o relleno irregular: los bloques no quedan alineados.
+        return base64.urlsafe_b64decode(encoded)
+    return decoded.getvalue()
+
+
+@lru_cache(maxsize=4)
+def _erp_pool_for_proxy(proxy_url: str) -> urllib3.PoolManager:
+    # Pool compartido (thread-safe): las facturas de un mismo ciclo reutilizan la conexion TLS al ERP.
+    if proxy_url:
+        return urllib3.ProxyManager(proxy_url, num_pools=2, maxsize=ERP_HTTP_POOL_SIZE)
+    return urllib3.PoolManager(num_pools=2, maxsize=ERP_HTTP_POOL_SIZE)
+
+
+def _erp_http_pool(url: str) -> urllib3.PoolManager:
+    """
+    Respeta HTTP(S)_PROXY y NO_PROXY igual que urllib.request.
+    """
+    parsed = urllib.parse.urlsplit(url)
+    proxy_url = urllib.request.getproxies().get(parsed.scheme, "")
+    if proxy_url and parsed.hostname and urllib.request.proxy_bypass(parsed.hostname):
+        proxy_url = ""
+    return _erp_pool_for_proxy(proxy_url)
+
+
+def _erp_request(url: str, body: bytes, headers: dict) -> urllib3.HTTPResponse:
+    """
+    POST al ERP con la misma politica de redireccion de urllib.request: 301/302/303 se repiten
+    como GET sin cuerpo; 307/308 y el exceso de saltos se devuelven tal cual (error HTTP).
+    """
+    method: str = "POST"
+    payload: Optional[bytes] = body
+    for _ in range(ERP_MAX_REDIRECTS + 1):
+        response = _erp_http_pool(url).request(
+            method,
+            url,
+            body=payload,
+            headers=headers,
+            timeout=60.0,
+            retries=False,
+        )
+        location = response.headers.get("Location") or response.headers.get("URI")
+        if response.status not in _REDIRECT_TO_GET_STATUS or not location:
+            return response
+        url = urllib.parse.urljoin(url, location)
+        method, payload = "GET", None
+        headers = {key: value for key, value in headers.items() if key.lower() not in ("content-type", "content-length")}
+    return response
+
+
+_DRIVE_ESCAPE = str.maketrans({"\\": "\\\\", "'": "\\'"})
 
 
 def _escape_drive_query_value(value: str) -> str:
-    return value.replace("\\", "\\\\").replace("'", "\\'")
+    return value.translate(_DRIVE_ESCAPE)
 
 
 def _is_skippable_attachment_error(exc: Exception) -> bool:
@@ -376,12 +544,17 @@ def _is_skippable_attachment_error(exc: Exception) -> bool:
     return any(marker in text for marker in markers)
 
 
-_TRANSIENT_HTTP_STATUS = {408, 429, 500, 502, 503, 504}
+_TRANSIENT_HTTP_STATUS = frozenset({408, 429, 500, 502, 503, 504})
+_TIMEOUT_RE = re.compile(r"timed out|temporarily unavailable", re.IGNORECASE)
 
 
 def _http_error_status(exc: Exception) -> Optional[int]:
     if not isinstance(exc, HttpError):
         return None
+    # googleapiclient reciente expone el estado ya como int.
+    status = getattr(exc, "status_code", None)
+    if isinstance(status, int):
+        return status
     resp = getattr(exc, "resp", None)
     if resp is None:
         return None
@@ -400,8 +573,7 @@ def _is_transient_google_error(exc: Exception) -> bool:
         return True
 
     if isinstance(exc, OSError):
-        message = str(exc).lower()
-        return "timed out" in message or "temporarily unavailable" in message
+        return _TIMEOUT_RE.search(str(exc)) is not None
 
     return False
 
@@ -430,7 +602,8 @@ def execute_google_with_retry(action, operation: str, attempts: int = 4, base_de
             last_error = exc
             if not _is_transient_google_error(exc) or attempt >= attempts:
                 raise
-            delay = min(base_delay_sec * (2 ** (attempt - 1)), 8.0)
+            # Jitter aleatorio para que procesos en paralelo no reintenten todos al mismo tiempo.
+            delay = min(base_delay_sec * (2 ** (attempt - 1)), 8.0) + random.uniform(0, base_delay_sec)
             LOGGER.warning(
                 "Error transitorio Google API en %s (intento %s/%s): %s. Reintentando en %.1fs.",
                 operation,
@@ -447,6 +620,8 @@ def execute_google_with_retry(action, operation: str, attempts: int = 4, base_de
 class MailAutomationService:
     def __init__(self, config: MailAutomationConfig) -> None:
         self.config = config
+        # La configuracion de precios no cambia durante la vida del servicio.
+        self._pricing_config = config.pricing_config()
         self.config.local_work_dir.mkdir(parents=True, exist_ok=True)
         (self.config.local_work_dir / "incoming").mkdir(parents=True, exist_ok=True)
         (self.config.local_work_dir / "output").mkdir(parents=True, exist_ok=True)
@@ -454,17 +629,20 @@ class MailAutomationService:
         self.gmail, self.drive, self.google_credentials = self._build_google_services()
         self._storage_client = None
         self._drive_lock = threading.RLock()
+        self._thread_http = threading.local()
+        self._drive_upload_executor: Optional[ThreadPoolExecutor] = None
         self._drive_folder_cache: dict[tuple[str, str], str] = {}
         self._drive_folder_files_cache: dict[str, set[str]] = {}
-        self.processed_label_id = self._ensure_gmail_label(self.config.processed_label_name)
+        self._gmail_label_ids: Optional[dict[str, str]] = None
+        self._label_state_path = self.config.local_work_dir / GMAIL_LABEL_STATE_FILE
+        self._cached_label_ids = self._load_label_state()
+        self.processed_label_id = ""
         self.entered_label_id: Optional[str] = None
         self.entered_synced_label_id: Optional[str] = None
-        if self.config.sync_entered_label:
-            self.entered_label_id = self._ensure_gmail_label(self.config.entered_label_name)
-            self.entered_synced_label_id = self._ensure_gmail_label(self.config.entered_synced_label_name)
+        self._resolve_gmail_labels()
 
     def _build_google_services(self):
-        Request, Credentials, InstalledAppFlow, build, _ = _import_google_deps()
+        Request, Credentials, InstalledAppFlow, build, _, _ = _import_google_deps()
 
         creds = self._load_credentials_from_token_store(Credentials)
         loaded_from = "token_store" if creds is not None else ""
@@ -508,8 +686,9 @@ class MailAutomationService:
             # Backfill bootstrap token into Firestore so refreshes do not depend on a read-only secret mount.
             self._persist_oauth_credentials(creds, source="bootstrap_file")
 
-        gmail = build("gmail", "v1", credentials=creds, cache_discovery=False)
-        drive = build("drive", "v3", credentials=creds, cache_discovery=False)
+        model = _google_json_model()
+        gmail = build("gmail", "v1", credentials=creds, cache_discovery=False, model=model)
+        drive = build("drive", "v3", credentials=creds, cache_discovery=False, model=model)
         return gmail, drive, creds
 
     def _build_token_store(self) -> Optional[FirestoreOAuthTokenStore]:
@@ -578,15 +757,75 @@ class MailAutomationService:
         normalized = str(path).replace("\\", "/")
         return normalized.startswith("/secrets/")
 
+    def _resolve_gmail_labels(self) -> None:
+        self.processed_label_id = self._ensure_gmail_label(self.config.processed_label_name)
+        self.entered_label_id = None
+        self.entered_synced_label_id = None
+        if self.config.sync_entered_label:
+            self.entered_label_id = self._ensure_gmail_label(self.config.entered_label_name)
+            self.entered_synced_label_id = self._ensure_gmail_label(self.config.entered_synced_label_name)
+        self._save_label_state()
+
+    def _load_label_state(self) -> dict[str, str]:
+        try:
+            payload = _loads_json_bytes(self._label_state_path.read_bytes())
+        except (OSError, ValueError):
+            return {}
+        labels = payload.get("labels") if isinstance(payload, dict) else None
+        if not isinstance(labels, dict):
+            return {}
+        return {str(name): str(label_id) for name, label_id in labels.items() if label_id}
+
+    def _save_label_state(self) -> None:
+        labels = {self.config.processed_label_name: self.processed_label_id}
+        if self.entered_label_id:
+            labels[self.config.entered_label_name] = self.entered_label_id
+        if self.entered_synced_label_id:
+            labels[self.config.entered_synced_label_name] = self.entered_synced_label_id
+        if labels == self._cached_label_ids:
+            return
+        try:
+            self._label_state_path.write_text(json.dumps({"labels": labels}), encoding="utf-8")
+        except OSError as exc:
+            LOGGER.warning("No se pudo guardar cache de etiquetas en %s (%s).", self._label_state_path, exc)
+            return
+        self._cached_label_ids = labels
+
+    def _modify_with_label_refresh(self, action):
+        try:
+            return action()
+        except HttpError as exc:
+            # Un id cacheado puede quedar invalido si la etiqueta se borro/recreo en Gmail.
+            if (
+                not self._cached_label_ids
+                or _http_error_status(exc) not in (400, 404)
+                or "label" not in str(exc).lower()
+            ):
+                raise
+            LOGGER.warning("Etiqueta Gmail cacheada invalida (%s); se vuelven a resolver.", exc)
+            self._cached_label_ids = {}
+            self._gmail_label_ids = None
+            self._resolve_gmail_labels()
+            return action()
+
     def _ensure_gmail_label(self, label_name: str) -> str:
-        labels_resp = execute_google_with_retry(
-            lambda: self.gmail.users().labels().list(userId="me").execute(),
-            operation="gmail.labels.list",
-        )
-        labels = labels_resp.get("labels", [])
-        for label in labels:
-            if label.get("name") == label_name:
-                return str(label["id"])
+        cached = self._cached_label_ids.get(label_name)
+        if cached:
+            return cached
+
+        # Un solo labels.list por instancia, aunque se resuelvan varias etiquetas al iniciar.
+        label_ids = self._gmail_label_ids
+        if label_ids is None:
+            labels_resp = execute_google_with_retry(
+                lambda: self.gmail.users().labels().list(userId="me").execute(),
+                operation="gmail.labels.list",
+            )
+            label_ids = {str(label.get("name")): str(label["id"]) for label in labels_resp.get("labels", [])}
+            self._gmail_label_ids = label_ids
+
+        label_id = label_ids.get(label_name)
+        if label_id:
+            return label_id
 
         created = execute_google_with_retry(
             lambda: self.gmail.users().labels().create(
@@ -599,7 +838,8 @@ class MailAutomationService:
             ).execute(),
             operation="gmail.labels.create",
         )
-        return str(created["id"])
+        label_ids[label_name] = str(created["id"])
+        return label_ids[label_name]
 
     def _resolve_runtime_options(self, runtime: Optional[RuntimeOptions] = None) -> RuntimeOptions:
         if runtime is None:
@@ -637,7 +877,8 @@ class MailAutomationService:
                 )
             except Exception as exc:
                 LOGGER.exception("Fallo en ciclo de automatizacion: %s", exc)
-            time.sleep(self.config.poll_interval_sec)
+            # +-15% para que instancias con el mismo intervalo no consulten Gmail sincronizadas.
+            time.sleep(self.config.poll_interval_sec * random.uniform(0.85, 1.15))
 
     def run_once(self, runtime: Optional[RuntimeOptions] = None) -> PollSummary:
         runtime_options = self._resolve_runtime_options(runtime)
@@ -654,34 +895,56 @@ class MailAutomationService:
                 self.sync_ingresado_messages(limit=self.config.max_messages_per_poll)
             return summary
 
-        if runtime_options.concurrency <= 1 or len(messages) <= 1:
-            for msg_ref in messages:
-                msg_id = str(msg_ref.get("id"))
-                if not msg_id:
-                    continue
-                message = self._download_message(message_id=msg_id, operation="gmail.messages.get")
-                outcome = self._process_downloaded_message(message, runtime_options)
-                summary.merge(outcome.summary)
-                if outcome.should_mark_processed:
-                    summary.label_ms += self._mark_message_processed(message.message_id)
-        else:
-            downloaded_messages: list[DownloadedMessage] = []
-            for msg_ref in messages:
-                msg_id = str(msg_ref.get("id"))
-                if not msg_id:
-                    continue
-                downloaded_messages.append(self._download_message(message_id=msg_id, operation="gmail.messages.get"))
-
-            with ThreadPoolExecutor(max_workers=min(runtime_options.concurrency, len(downloaded_messages))) as executor:
-                futures = {
-                    executor.submit(self._process_downloaded_message, message, runtime_options): message.message_id
-                    for message in downloaded_messages
-                }
-                for future in as_completed(futures):
-                    outcome = future.result()
+        message_ids = [str(msg_ref.get("id") or "") for msg_ref in messages]
+        message_ids = [msg_id for msg_id in message_ids if msg_id]
+        prefetched: dict[str, dict] = {}
+        if len(message_ids) > 1:
+            batch_started = time.perf_counter()
+            prefetched = self._prefetch_messages(message_ids, operation="gmail.messages.batch_get")
+            summary.gmail_download_ms += (time.perf_counter() - batch_started) * 1000
+
+        # Las etiquetas se aplican al final del ciclo con batchModify; si un mensaje posterior lanza
+        # excepcion, lo ya procesado se marca igual sin que un fallo al marcar oculte el error original.
+        processed_ids: list[str] = []
+        try:
+            if runtime_options.concurrency <= 1 or len(message_ids) <= 1:
+                for msg_id in message_ids:
+                    message = self._download_message(
+                        message_id=msg_id,
+                        operation="gmail.messages.get",
+                        prefetched=prefetched.get(msg_id),
+                    )
+                    outcome = self._process_downloaded_message(message, runtime_options)
                     summary.merge(outcome.summary)
                     if outcome.should_mark_processed:
-                        summary.label_ms += self._mark_message_processed(outcome.message_id)
+                        processed_ids.append(message.message_id)
+            else:
+                downloaded_messages: list[DownloadedMessage] = [
+                    self._download_message(
+                        message_id=msg_id,
+                        operation="gmail.messages.get",
+                        prefetched=prefetched.get(msg_id),
+                    )
+                    for msg_id in message_ids
+                ]
+
+                with ThreadPoolExecutor(max_workers=min(runtime_options.concurrency, len(downloaded_messages))) as executor:
+                    futures = {
+                        executor.submit(self._process_downloaded_message, message, runtime_options): message.message_id
+                        for message in downloaded_messages
+                    }
+                    for future in as_completed(futures):
+                        outcome = future.result()
+                        summary.merge(outcome.summary)
+                        if outcome.should_mark_processed:
+                            processed_ids.append(outcome.message_id)
+        except BaseException:
+            try:
+                summary.label_ms += self._mark_messages_processed(processed_ids)
+            except Exception:
+                LOGGER.exception("No se pudieron marcar %s mensajes ya procesados.", len(processed_ids))
+            raise
+        summary.label_ms += self._mark_messages_processed(processed_ids)
 
         if self.config.sync_entered_label and not runtime_options.skip_ingresado_sync:
             self.sync_ingresado_messages(limit=self.config.max_messages_per_poll)
@@ -730,10 +993,24 @@ class MailAutomationService:
             )
         return moved_folders
 
-    def process_message_by_id(self, message_id: str, runtime: Optional[RuntimeOptions] = None) -> tuple[int, int, bool]:
+    def prefetch_messages(self, message_ids: list[str]) -> dict[str, dict]:
+        if len(message_ids) <= 1:
+            return {}
+        return self._prefetch_messages(message_ids, operation="gmail.messages.batch_get.by_id")
+
+    def process_message_by_id(
+        self,
+        message_id: str,
+        runtime: Optional[RuntimeOptions] = None,
+        prefetched: Optional[dict] = None,
+    ) -> tuple[int, int, bool]:
         runtime_options = self._resolve_runtime_options(runtime)
         self._validate_runtime_options(runtime_options)
-        message = self._download_message(message_id=message_id, operation="gmail.messages.get.by_id")
+        message = self._download_message(
+            message_id=message_id,
+            operation="gmail.messages.get.by_id",
+            prefetched=prefetched,
+        )
         outcome = self._process_downloaded_message(message, runtime_options)
         if outcome.should_mark_processed:
             outcome.summary.label_ms += self._mark_message_processed(message_id)
@@ -790,12 +1067,68 @@ class MailAutomationService:
             if not page_token:
                 return messages
 
-    def _download_message(self, message_id: str, operation: str) -> DownloadedMessage:
-        started = time.perf_counter()
-        message = execute_google_with_retry(
-            lambda: self.gmail.users().messages().get(userId="me", id=message_id, format="full").execute(),
-            operation=operation,
+    def _message_get_request(self, message_id: str):
+        return self.gmail.users().messages().get(
+            userId="me",
+            id=message_id,
+            format="full",
+            fields=GMAIL_MESSAGE_FIELDS,
         )
+
+    def _prefetch_messages(self, message_ids: list[str], operation: str) -> dict[str, dict]:
+        """
+        Descarga varios messages.get en lotes (BatchHttpRequest): una peticion HTTP por bloque.
+        Los mensajes que fallen dentro del lote no se devuelven y se descargan luego uno a uno.
+        """
+        prefetched: dict[str, dict] = {}
+
+        def _store(request_id, response, exception) -> None:
+            if exception is None:
+                prefetched[request_id] = response
+            else:
+                LOGGER.warning(
+                    "messages.get en lote fallo para id=%s (%s). Se reintentara individual.",
+                    request_id,
+                    exception,
+                )
+
+        unique_ids = list(dict.fromkeys(message_ids))
+        for start in range(0, len(unique_ids), GMAIL_BATCH_SIZE):
+            chunk = unique_ids[start : start + GMAIL_BATCH_SIZE]
+
+            def _execute_batch(chunk=chunk) -> None:
+                batch = self.gmail.new_batch_http_request(callback=_store)
+                for message_id in chunk:
+                    if message_id not in prefetched:
+                        batch.add(self._message_get_request(message_id), request_id=message_id)
+                batch.execute()
+
+            try:
+                execute_google_with_retry(_execute_batch, operation=operation)
+            except Exception as exc:
+                LOGGER.warning("No se pudo descargar lote de mensajes (%s). Se descargaran uno a uno.", exc)
+        return prefetched
+
+    def _download_message(
+        self,
+        message_id: str,
+        operation: str,
+        prefetched: Optional[dict] = None,
+    ) -> DownloadedMessage:
+        started = time.perf_counter()
+        message = prefetched
+        if message is None:
+            message = execute_google_with_retry(
+                lambda: self._message_get_request(message_id).execute(),
+                operation=operation,
+            )
+        if _has_inline_zip_part(message) or _message_parts_truncated(message):
+            # ZIP sin attachmentId (su contenido solo viene en body.data) o partes mas profundas que la
+            # mascara de campos: se pide el mensaje completo.
+            message = execute_google_with_retry(
+                lambda: self.gmail.users().messages().get(userId="me", id=message_id, format="full").execute(),
+                operation=f"{operation}.full",
+            )
         subject = _message_subject(message)
         zip_attachments = self._extract_zip_attachments(message_id, message)
         elapsed_ms = (time.perf_counter() - started) * 1000
@@ -886,7 +1219,8 @@ class MailAutomationService:
             body = part.get("body") or {}
             encoded = body.get("data")
             attachment_id = body.get("attachmentId")
-            if attachment_id:
+            if not encoded and attachment_id:
+                # Solo se descarga aparte si el contenido no vino ya en body.data.
                 response = execute_google_with_retry(
                     lambda: self.gmail.users().messages().attachments().get(
                         userId="me",
@@ -900,7 +1234,7 @@ class MailAutomationService:
             if not encoded:
                 continue
 
-            raw = base64.urlsafe_b64decode(encoded.encode("utf-8"))
+            raw = _decode_base64url(encoded)
             attachments.append((_safe_name(filename), raw))
 
         return attachments
@@ -955,7 +1289,7 @@ class MailAutomationService:
             input_name=attachment_name,
             input_bytes=data,
             output_path=output_base if not runtime.skip_drive else None,
-            config=self.config.pricing_config(),
+            config=self._pricing_config,
             sheet_name=self.config.sheet_name,
             rules_path=self.config.rules_path,
             generate_output=not runtime.skip_drive,
@@ -984,7 +1318,7 @@ class MailAutomationService:
             input_name=attachment_name,
             input_bytes=data,
             output_path=output_base if not runtime.skip_drive else None,
-            config=self.config.pricing_config(),
+            config=self._pricing_config,
             sheet_name=self.config.sheet_name,
             rules_path=self.config.rules_path,
             generate_output=not runtime.skip_drive,
@@ -1127,30 +1461,26 @@ class MailAutomationService:
             raise AutomationError("Configura erp_base_url para ingerir el ZIP en el ERP.")
 
         url = f"{self.config.erp_base_url.rstrip('/')}/api/purchases/ingest"
-        req_data = json.dumps(payload).encode("utf-8")
-        req = urllib.request.Request(url, data=req_data, method="POST")
-        req.add_header("Content-Type", "application/json")
+        # El payload puede llevar el PDF en base64 y el XML completo: orjson serializa directo a bytes,
+        # sin el str intermedio de json.dumps + encode.
+        req_data = orjson.dumps(payload) if orjson is not None else json.dumps(payload).encode("utf-8")
+        headers = {"Content-Type": "application/json"}
         if self.config.erp_api_key:
-            req.add_header("X-API-Key", self.config.erp_api_key)
+            headers["X-API-Key"] = self.config.erp_api_key
 
         started = time.perf_counter()
         try:
-            with urllib.request.urlopen(req, timeout=60) as response:
-                status = response.status
-                body = response.read().decode("utf-8", errors="replace")
-        except urllib.error.HTTPError as exc:
-            body = ""
-            try:
-                body = exc.read().decode("utf-8", errors="replace")[:500]
-            except Exception:
-                pass
-            raise AutomationError(
-                f"ERP devolvio HTTP {exc.code} para invoice={invoice_ref or '?'} body={body}"
-            ) from exc
+            response = _erp_request(url, req_data, headers)
         except Exception as exc:
             raise AutomationError(
                 f"ERP ingestion failed para invoice={invoice_ref or '?'}: {exc}"
             ) from exc
+        status = response.status
+        body = response.data.decode("utf-8", errors="replace")
+        if not 200 <= status < 300:
+            raise AutomationError(
+                f"ERP devolvio HTTP {status} para invoice={invoice_ref or '?'} body={body[:500]}"
+            )
 
         erp_ms = (time.perf_counter() - started) * 1000
         LOGGER.info(
@@ -1175,10 +1505,36 @@ class MailAutomationService:
 
         with self._drive_lock:
             folder_id = self._ensure_drive_folder(local_folder.name, self.config.drive_parent_folder_id)
+            # El listado se hace una vez en este hilo: el cliente compartido de Drive no es thread-safe.
+            existing_file_names = self._list_drive_folder_file_names(folder_id)
+            files: list[Path] = []
             for item in local_folder.iterdir():
                 if not item.is_file():
                     continue
-                self._upload_file_if_missing(item, folder_id)
+                if item.name in existing_file_names:
+                    LOGGER.info("Archivo ya existe en Drive, se conserva: %s", item.name)
+                    continue
+                files.append(item)
+
+            if len(files) <= 1:
+                for item in files:
+                    self._upload_drive_file(item, folder_id)
+                    existing_file_names.add(item.name)
+                return
+
+            # Las subidas son independientes entre si; un fallo no cancela las demas y se relanza al final.
+            errors: list[Exception] = []
+            executor = self._drive_upload_pool()
+            futures = {executor.submit(self._upload_drive_file, item, folder_id): item for item in files}
+            for future in as_completed(futures):
+                exc = future.exception()
+                if exc is not None:
+                    LOGGER.error("No se pudo subir archivo a Drive: %s (%s)", futures[future], exc)
+                    errors.append(exc)
+                    continue
+                existing_file_names.add(futures[future].name)
+            if errors:
+                raise errors[0]
 
     def _cache_drive_folder(self, folder_name: str, parent_id: str, folder_id: str) -> str:
         self._drive_folder_cache[(parent_id, folder_name)] = folder_id
@@ -1199,7 +1555,7 @@ class MailAutomationService:
                 "q": query,
                 "spaces": "drive",
                 "fields": "nextPageToken,files(name)",
-                "pageSize": 200,
+                "pageSize": 1000,
             }
             if page_token:
                 request_kwargs["pageToken"] = page_token
@@ -1293,14 +1649,35 @@ class MailAutomationService:
             LOGGER.info("Carpeta movida a '%s': %s", self.config.entered_drive_subfolder_name, folder_name)
             return True
 
-    def _upload_file_if_missing(self, local_file: Path, drive_folder_id: str) -> None:
-        _, _, _, _, MediaFileUpload = _import_google_deps()
-        existing_file_names = self._list_drive_folder_file_names(drive_folder_id)
-        if local_file.name in existing_file_names:
-            LOGGER.info("Archivo ya existe en Drive, se conserva: %s", local_file.name)
-            return
-
-        media = MediaFileUpload(str(local_file), resumable=False)
+    def _drive_upload_pool(self) -> ThreadPoolExecutor:
+        """
+        Pool de subidas que vive con el servicio: sus hilos conservan su AuthorizedHttp entre sincronizaciones.
+        Se llama con _drive_lock tomado.
+        """
+        if self._drive_upload_executor is None:
+            self._drive_upload_executor = ThreadPoolExecutor(max_workers=DRIVE_UPLOAD_WORKERS, thread_name_prefix="drive-upload")
+        return self._drive_upload_executor
+
+    def _thread_drive_http(self):
+        """
+        httplib2.Http no es thread-safe: cada hilo que sube archivos usa su propia conexion autorizada.
+        """
+        http = getattr(self._thread_http, "drive", None)
+        if http is None:
+            from google_auth_httplib2 import AuthorizedHttp
+            from googleapiclient.http import build_http
+
+            http = AuthorizedHttp(self.google_credentials, http=build_http())
+            self._thread_http.drive = http
+        return http
+
+    def _upload_drive_file(self, local_file: Path, drive_folder_id: str) -> None:
+        _, _, _, _, MediaFileUpload, MediaIoBaseUpload = _import_google_deps()
+        if local_file.stat().st_size <= DRIVE_INLINE_UPLOAD_MAX_BYTES:
+            mimetype = mimetypes.guess_type(local_file.name)[0] or "application/octet-stream"
+            media = MediaIoBaseUpload(io.BytesIO(local_file.read_bytes()), mimetype=mimetype, resumable=False)
+        else:
+            media = MediaFileUpload(str(local_file), resumable=False)
         execute_google_with_retry(
             lambda: self.drive.files().create(
                 body={
@@ -1309,39 +1686,67 @@ class MailAutomationService:
                 },
                 media_body=media,
                 fields="id,name",
-            ).execute(),
+            ).execute(http=self._thread_drive_http()),
             operation="drive.files.create.file",
         )
-        existing_file_names.add(local_file.name)
         LOGGER.info("Archivo subido a Drive: %s", local_file)
 
     def _mark_message_processed(self, message_id: str) -> float:
         remove = ["UNREAD"] if self.config.mark_as_read else []
         started = time.perf_counter()
-        execute_google_with_retry(
-            lambda: self.gmail.users().messages().modify(
-                userId="me",
-                id=message_id,
-                body={
-                    "addLabelIds": [self.processed_label_id],
-                    "removeLabelIds": remove,
-                },
-            ).execute(),
-            operation="gmail.messages.modify",
+        self._modify_with_label_refresh(
+            lambda: execute_google_with_retry(
+                lambda: self.gmail.users().messages().modify(
+                    userId="me",
+                    id=message_id,
+                    body={
+                        "addLabelIds": [self.processed_label_id],
+                        "removeLabelIds": remove,
+                    },
+                ).execute(),
+                operation="gmail.messages.modify",
+            )
         )
         return (time.perf_counter() - started) * 1000
 
+    def _mark_messages_processed(self, message_ids: list[str]) -> float:
+        if not message_ids:
+            return 0.0
+        if len(message_ids) == 1:
+            # modify cuesta 5 unidades de cuota; batchModify cuesta 50 sin importar cuantos ids lleve.
+            return self._mark_message_processed(message_ids[0])
+        remove = ["UNREAD"] if self.config.mark_as_read else []
+        started = time.perf_counter()
+        for start in range(0, len(message_ids), GMAIL_BATCH_MODIFY_LIMIT):
+            chunk = message_ids[start : start + GMAIL_BATCH_MODIFY_LIMIT]
+            self._modify_with_label_refresh(
+                lambda chunk=chunk: execute_google_with_retry(
+                    lambda: self.gmail.users().messages().batchModify(
+                        userId="me",
+                        body={
+                            "ids": chunk,
+                            "addLabelIds": [self.processed_label_id],
+                            "removeLabelIds": remove,
+                        },
+                    ).execute(),
+                    operation="gmail.messages.batchModify",
+                )
+            )
+        return (time.perf_counter() - started) * 1000
+
     def _mark_ingresado_synced(self, message_id: str) -> None:
         if not self.entered_synced_label_id:
             return
-        execute_google_with_retry(
-            lambda: self.gmail.users().messages().modify(
-                userId="me",
-                id=message_id,
-                body={
-                    "addLabelIds": [self.entered_synced_label_id],
-                    "removeLabelIds": [],
-                },
-            ).execute(),
-            operation="gmail.messages.modify.ingresado_synced",
+        self._modify_with_label_refresh(
+            lambda: execute_google_with_retry(
+                lambda: self.gmail.users().messages().modify(
+                    userId="me",
+                    id=message_id,
+                    body={
+                        "addLabelIds": [self.entered_synced_label_id],
+                        "removeLabelIds": [],
+                    },
+                ).execute(),
+                operation="gmail.messages.modify.ingresado_synced",
+            )
         )
@@ -1,10 +1,12 @@
 import base64
 from dataclasses import asdict
+import hmac
 import json
 import logging
 import os
 from pathlib import Path
 import threading
+import time
 from typing import Optional
 import zipfile
 
@@ -13,6 +15,11 @@ from google.api_core.exceptions import NotFound
 from google.cloud import firestore
 from googleapiclient.errors import HttpError
 
+try:
+    import orjson
+except ImportError:  # json de la stdlib como respaldo
+    orjson = None
+
 from .mail_automation import (
     AutomationError,
     MailAutomationConfig,
@@ -28,6 +35,8 @@ from .mail_automation import (
 
 LOGGER = logging.getLogger(__name__)
 MAX_UPLOAD_BYTES = 50 * 1024 * 1024
+# Vigencia del last_history_id en memoria antes de volver a leer Firestore.
+WATCH_STATE_CACHE_TTL_SEC = 60.0
 
 
 def _bool_env(name: str, default: bool) -> bool:
@@ -51,21 +60,35 @@ def _str_env(name: str, default: str = "") -> str:
     return value.strip()
 
 
+# Un firestore.Client por proyecto y proceso: comparte canal gRPC y refresco de credenciales.
+_FIRESTORE_CLIENTS: dict[str, firestore.Client] = {}
+_FIRESTORE_CLIENTS_LOCK = threading.Lock()
+
+
+def _firestore_client(project_id: str) -> firestore.Client:
+    with _FIRESTORE_CLIENTS_LOCK:
+        client = _FIRESTORE_CLIENTS.get(project_id)
+        if client is None:
+            client = firestore.Client(project=project_id) if project_id else firestore.Client()
+            _FIRESTORE_CLIENTS[project_id] = client
+        return client
+
+
 class WatchStateStore:
     def __init__(self, project_id: str, collection_name: str, document_id: str) -> None:
-        if project_id:
-            self.client = firestore.Client(project=project_id)
-        else:
-            self.client = firestore.Client()
+        self.client = _firestore_client(project_id)
         self.doc_ref = self.client.collection(collection_name).document(document_id)
-
-    def get_last_history_id(self) -> Optional[str]:
-        snapshot = self.doc_ref.get()
-        if not snapshot.exists:
-            return None
-        data = snapshot.to_dict() or {}
-        value = data.get("last_history_id")
-        return str(value) if value else None
+        self._cached_history_id: Optional[str] = None
+        self._cache_ts = 0.0
+
+    def get_last_history_id(self, force_refresh: bool = False) -> Optional[str]:
+        if (
+            not force_refresh
+            and self._cached_history_id is not None
+            and time.monotonic() - self._cache_ts < WATCH_STATE_CACHE_TTL_SEC
+        ):
+            return self._cached_history_id
+        return self._remember_history_id(self.read_state())
 
     def set_last_history_id(self, history_id: str, watch_expiration: Optional[str] = None) -> None:
         payload = {
@@ -75,38 +98,61 @@ class WatchStateStore:
         if watch_expiration:
             payload["watch_expiration"] = str(watch_expiration)
         self.doc_ref.set(payload, merge=True)
+        self._cached_history_id = str(history_id)
+        self._cache_ts = time.monotonic()
 
     def read_state(self) -> dict:
         snapshot = self.doc_ref.get()
         if not snapshot.exists:
             return {}
-        return snapshot.to_dict() or {}
+        data = snapshot.to_dict() or {}
+        self._remember_history_id(data)
+        return data
+
+    def _remember_history_id(self, data: dict) -> Optional[str]:
+        value = data.get("last_history_id")
+        self._cached_history_id = str(value) if value else None
+        self._cache_ts = time.monotonic()
+        return self._cached_history_id
 
 
 class LocalFileStateStore:
     def __init__(self, path: Path) -> None:
         self.path = path
         self.path.parent.mkdir(parents=True, exist_ok=True)
+        self._state: Optional[dict] = None
 
     def get_last_history_id(self) -> Optional[str]:
-        data = self.read_state()
-        value = data.get("last_history_id")
+        value = self._load().get("last_history_id")
         return str(value) if value else None
 
     def set_last_history_id(self, history_id: str, watch_expiration: Optional[str] = None) -> None:
-        data = self.read_state()
+        data = dict(self._load())
         data["last_history_id"] = str(history_id)
         if watch_expiration is not None:
             data["watch_expiration"] = str(watch_expiration)
-        self.path.write_text(json.dumps(data, ensure_ascii=True, indent=2), encoding="utf-8")
+        # Escritura atomica: un corte a mitad de escritura no deja el JSON truncado.
+        tmp_path = self.path.with_suffix(self.path.suffix + ".tmp")
+        tmp_path.write_text(json.dumps(data, ensure_ascii=True, indent=2), encoding="utf-8")
+        tmp_path.replace(self.path)
+        self._state = data
 
     def read_state(self) -> dict:
-        if not self.path.exists():
-            return {}
-        try:
-            return json.loads(self.path.read_text(encoding="utf-8"))
-        except Exception:
-            return {}
+        return dict(self._load())
+
+    def reload(self) -> None:
+        self._state = None
+
+    def _load(self) -> dict:
+        # El archivo solo lo escribe este proceso: se parsea una vez y se mantiene en memoria.
+        if self._state is None:
+            try:
+                raw = self.path.read_bytes()
+                data = orjson.loads(raw) if orjson is not None else json.loads(raw)
+            except Exception:
+                data = {}
+            self._state = data if isinstance(data, dict) else {}
+        return self._state
 
 
 class GmailPushProcessor:
@@ -290,9 +336,14 @@ class GmailPushProcessor:
             raise
 
         processed = PollSummary()
+        # Un BatchHttpRequest por bloque de mensajes en vez de un messages.get por id.
+        prefetched = mail.prefetch_messages(message_ids)
         for message_id in message_ids:
             try:
-                ok_count, skip_count, failed = mail.process_message_by_id(message_id)
+                ok_count, skip_count, failed = mail.process_message_by_id(
+                    message_id,
+                    prefetched=prefetched.get(message_id),
+                )
             except Exception as exc:
                 if is_transient_google_error(exc):
                     raise
@@ -319,7 +370,7 @@ class GmailPushProcessor:
         }
 
     def _list_message_ids_from_history(self, start_history_id: str, mail: MailAutomationService) -> list[str]:
-        ids: dict[str, bool] = {}
+        ids: list[str] = []
         page_token = None
         while True:
             history_req = mail.gmail.users().history().list(
@@ -328,6 +379,8 @@ class GmailPushProcessor:
                 historyTypes=["messageAdded"],
                 pageToken=page_token,
                 maxResults=500,
+                # Solo se usan los ids de mensajes agregados; Gmail omite el resto del historial.
+                fields="nextPageToken,history(messagesAdded(message(id)))",
             )
             response = execute_google_with_retry(
                 lambda: history_req.execute(),
@@ -339,12 +392,12 @@ class GmailPushProcessor:
                     msg = added.get("message") or {}
                     msg_id = str(msg.get("id") or "").strip()
                     if msg_id:
-                        ids[msg_id] = True
+                        ids.append(msg_id)
 
             page_token = response.get("nextPageToken")
             if not page_token:
                 break
-        return list(ids.keys())
+        return list(dict.fromkeys(ids))
 
     def manual_sync(
         self,
@@ -365,13 +418,93 @@ class GmailPushProcessor:
         return self.state.read_state()
 
 
+def _latest_history_id(current: Optional[str], other: Optional[str]) -> Optional[str]:
+    if not other:
+        return current
+    if not current:
+        return other
+    try:
+        return current if int(current) >= int(other) else other
+    except ValueError:
+        return other
+
+
+class PushCoalescer:
+    """
+    Serializa process_push_history sin descartar los push que llegan mientras hay otra operacion.
+    Se guarda el historyId mas reciente pendiente y lo procesa quien tenga el lock al terminar;
+    como history.list parte del ultimo id guardado, procesar el mas reciente cubre a los anteriores.
+    Con `debounce_sec` > 0 se espera antes de procesar para agrupar rafagas de notificaciones; solo
+    sirve si la instancia atiende peticiones concurrentes (con --concurrency 1 nada llega durante la espera).
+    """
+
+    def __init__(self, operation_lock: threading.Lock, debounce_sec: float = 0.0) -> None:
+        self._operation_lock = operation_lock
+        self._debounce_sec = debounce_sec
+        self._pending_lock = threading.Lock()
+        self._pending_history_id: Optional[str] = None
+
+    def run(self, history_id: str, process) -> Optional[list]:
+        """
+        Devuelve los resultados procesados, o None si el push quedo en cola para otra peticion.
+        """
+        results = []
+        processed: Optional[str] = None
+        current: Optional[str] = history_id
+        while current:
+            with self._pending_lock:
+                current = _latest_history_id(current, self._pending_history_id)
+                if not self._operation_lock.acquire(blocking=False):
+                    self._pending_history_id = current
+                    return results or None
+                self._pending_history_id = None
+            try:
+                if not results and self._debounce_sec > 0:
+                    # Los push de la rafaga quedan como pendientes; se procesa solo el mas reciente.
+                    time.sleep(self._debounce_sec)
+                    with self._pending_lock:
+                        current = _latest_history_id(current, self._pending_history_id)
+                        self._pending_history_id = None
+                results.append(process(current))
+                processed = current
+            finally:
+                # Liberar y revisar pendientes de forma atomica: un push que falle el acquire
+                # justo antes de liberar queda registrado y se toma en la siguiente vuelta.
+                with self._pending_lock:
+                    self._operation_lock.release()
+                    current = self._pending_history_id
+                    if current and processed and _latest_history_id(processed, current) == processed:
+                        # Un historyId que no supera al ya procesado quedo cubierto por ese history.list.
+                        self._pending_history_id = None
+                        current = None
+        return results
+
+    def drain(self, process) -> Optional[list]:
+        """
+        Procesa el push que quedo en cola mientras otra operacion (full-sync, start-watch, process-zip)
+        tenia el lock; sin esto el historyId esperaria hasta la siguiente notificacion de Gmail.
+        """
+        with self._pending_lock:
+            pending = self._pending_history_id
+        if not pending:
+            return None
+        try:
+            return self.run(pending, process)
+        except Exception:
+            # Pub/Sub ya recibio respuesta por ese push: se deja en cola para el siguiente que llegue.
+            with self._pending_lock:
+                self._pending_history_id = _latest_history_id(pending, self._pending_history_id)
+            raise
+
+
 def _require_admin_token() -> None:
     token = _str_env("FACTURADOR_ADMIN_TOKEN")
     if not token:
         return
 
     provided = request.headers.get("X-Facturador-Admin-Token", "")
-    if provided != token:
+    # Comparacion en tiempo constante para no filtrar el token por tiempos de respuesta.
+    if not hmac.compare_digest(provided.encode("utf-8"), token.encode("utf-8")):
         abort(401, description="Unauthorized")
 
 
@@ -383,8 +516,8 @@ def _decode_pubsub_payload(request_body: dict) -> dict:
     if not data_b64:
         raise ValueError("Payload Pub/Sub invalido: falta 'message.data'.")
     raw = base64.b64decode(data_b64)
-    decoded = raw.decode("utf-8")
-    payload = json.loads(decoded)
+    # Ambos parsers aceptan bytes UTF-8 directamente, sin un str intermedio.
+    payload = orjson.loads(raw) if orjson is not None else json.loads(raw)
     if not isinstance(payload, dict):
         raise ValueError("Payload Pub/Sub invalido: JSON de Gmail no es objeto.")
     return payload
@@ -405,6 +538,22 @@ def create_app() -> Flask:
     app.config["MAX_CONTENT_LENGTH"] = MAX_UPLOAD_BYTES
     processor = GmailPushProcessor()
     operation_lock = threading.Lock()
+    push_coalescer = PushCoalescer(
+        operation_lock,
+        debounce_sec=_int_env("FACTURADOR_PUSH_DEBOUNCE_MS", 0) / 1000,
+    )
+
+    def _process_push(history_id: str) -> dict:
+        result = processor.process_push_history(history_id)
+        LOGGER.info("Push procesado: %s", result)
+        return result
+
+    def _release_operation_lock() -> None:
+        operation_lock.release()
+        try:
+            push_coalescer.drain(_process_push)
+        except Exception as exc:
+            LOGGER.exception("Error procesando push en cola: %s", exc)
 
     @app.get("/healthz")
     def healthz():
@@ -421,14 +570,9 @@ def create_app() -> Flask:
             history_id = str(payload.get("historyId") or "").strip()
             if not history_id:
                 raise ValueError("Notificacion Gmail sin historyId.")
-            if not operation_lock.acquire(blocking=False):
-                LOGGER.info("Push omitido por operacion en curso. history_id=%s", history_id)
-                return jsonify({"ok": True, "skipped": "busy"}), 200
-            try:
-                result = processor.process_push_history(history_id)
-                LOGGER.info("Push procesado: %s", result)
-            finally:
-                operation_lock.release()
+            if push_coalescer.run(history_id, _process_push) is None:
+                LOGGER.info("Push en cola por operacion en curso. history_id=%s", history_id)
+                return jsonify({"ok": True, "queued": "busy"}), 200
         except OAuthTokenInvalidError as exc:
             LOGGER.error("Push en modo degradado por OAuth invalido: %s", exc)
             LOGGER.error("facturador_health_degraded reason=%s source=pubsub_push", exc.reason)
@@ -467,7 +611,7 @@ def create_app() -> Flask:
                 LOGGER.exception("Error iniciando watch: %s", exc)
                 return jsonify({"ok": False, "error": str(exc)}), 500
         finally:
-            operation_lock.release()
+            _release_operation_lock()
         return jsonify(result), 200
 
     @app.post("/admin/full-sync")
@@ -506,7 +650,7 @@ def create_app() -> Flask:
                 LOGGER.exception("Error en full-sync: %s", exc)
                 return jsonify({"ok": False, "error": str(exc)}), 500
         finally:
-            operation_lock.release()
+            _release_operation_lock()
         return jsonify(asdict(summary)), 200
 
     @app.post("/admin/process-zip")
@@ -555,7 +699,7 @@ def create_app() -> Flask:
                 LOGGER.exception("Error procesando ZIP manual: %s", exc)
                 return jsonify({"ok": False, "code": "process_zip_failed", "error": str(exc)}), 500
         finally:
-            operation_lock.release()
+            _release_operation_lock()
 
         return jsonify(result), 200
 
@@ -1,9 +1,9 @@
 from dataclasses import dataclass
 from decimal import Decimal, ROUND_HALF_UP, ROUND_CEILING, ROUND_FLOOR
-from typing import List, Optional
+from typing import List, Optional, Union
 
-from .invoice_parser import InvoiceLine
-from .rules import PricingRule, find_rule
+from .invoice_parser import InvoiceLine, InvoiceLineBatch
+from .rules import PricingRule, RulesIndex, find_rule
 
 
 @dataclass
@@ -30,8 +30,14 @@ class PriceRow:
     markup_percent: Optional[Decimal] = None
 
 
+_D0 = Decimal("0")
+_D1 = Decimal("1")
+_D001 = Decimal("0.01")
+_D1000 = Decimal("1000")
+
+
 def _money(value: Decimal) -> Decimal:
-    return value.quantize(Decimal("0.01"), rounding=ROUND_HALF_UP)
+    return value.quantize(_D001, rounding=ROUND_HALF_UP)
 
 
 def _round_to_step(value: Decimal, step: Decimal, mode: str) -> Decimal:
@@ -52,59 +58,74 @@ def _round_to_step(value: Decimal, step: Decimal, mode: str) -> Decimal:
         raise ValueError(f"Rounding mode no soportado: {mode}")
     result = rounded * step
     # Evitar cifras cerradas en miles (ej: 16000); si cae exacto, subir un paso.
-    if result % Decimal("1000") == 0:
+    if result % _D1000 == 0:
         result += step
     return result
 
 
 def build_price_rows(
-    lines: List[InvoiceLine],
+    lines: Union[InvoiceLineBatch, List[InvoiceLine]],
     config: MarkupConfig,
     rules: Optional[List[PricingRule]] = None,
 ) -> List[PriceRow]:
+    batch = lines if isinstance(lines, InvoiceLineBatch) else InvoiceLineBatch.from_lines(lines)
     rows: List[PriceRow] = []
-    for line in lines:
-        qty = line.quantity
-        tax_factor = (line.tax_percent or Decimal("0")) / Decimal("100")
-        base_unit = Decimal("0")
+    # Valores constantes durante toda la factura: se leen una vez fuera del ciclo.
+    rule_index = RulesIndex.from_rules(rules or [])
+    threshold = config.threshold
+    below_divisor = config.below_divisor
+    above_multiplier = config.above_multiplier
+    round_net_step = config.round_net_step
+    rounding_mode = config.rounding_mode
+    # Una factura suele repetir 2-3 tasas de IVA y descuento: se memorizan sus factores.
+    tax_multipliers: dict = {}
+    discount_factors: dict = {}
+    for line_id, description, supplier_reference, qty, _, tax_percent, base_amount, discount_percent in batch.rows():
+        tax_multiplier = tax_multipliers.get(tax_percent)
+        if tax_multiplier is None:
+            tax_multiplier = tax_multipliers[tax_percent] = _D1 + (tax_percent or _D0) * _D001
+        base_unit = _D0
         if qty == 0:
-            cost_bruto_unit = Decimal("0")
+            cost_bruto_unit = _D0
         else:
             # Precio base por unidad (antes de descuento)
-            base_unit = line.base_amount / qty
+            base_unit = base_amount / qty
             cost_bruto_unit = base_unit
-        discount_factor = Decimal("1") - (line.discount_percent / Decimal("100"))
-        if discount_factor < 0:
-            discount_factor = Decimal("0")
+        discount_factor = discount_factors.get(discount_percent)
+        if discount_factor is None:
+            discount_factor = _D1 - discount_percent * _D001
+            if discount_factor < 0:
+                discount_factor = _D0
+            discount_factors[discount_percent] = discount_factor
 
         # Costo neto incluye descuento e IVA
-        cost_neto_unit = base_unit * discount_factor * (Decimal("1") + tax_factor)
+        cost_neto_unit = base_unit * discount_factor * tax_multiplier
 
         # Utilidad sobre costo neto => valor de venta neto; luego quitar IVA para venta bruta.
-        rule = find_rule(line.description, rules or [])
+        rule = find_rule(description, rule_index)
         if rule and rule.utilidad_percent is not None:
-            venta_neta_unit_raw = cost_neto_unit * (Decimal("1") + rule.utilidad_percent / Decimal("100"))
+            venta_neta_unit_raw = cost_neto_unit * (_D1 + rule.utilidad_percent * _D001)
         else:
             venta_neta_unit_raw = (
-                cost_neto_unit / config.below_divisor
-                if cost_neto_unit < config.threshold
-                else cost_neto_unit * config.above_multiplier
+                cost_neto_unit / below_divisor
+                if cost_neto_unit < threshold
+                else cost_neto_unit * above_multiplier
             )
-        venta_neta_unit = _round_to_step(venta_neta_unit_raw, config.round_net_step, config.rounding_mode)
-        venta_bruta_unit = venta_neta_unit / (Decimal("1") + tax_factor)
+        venta_neta_unit = _round_to_step(venta_neta_unit_raw, round_net_step, rounding_mode)
+        venta_bruta_unit = venta_neta_unit / tax_multiplier
 
         rows.append(
             PriceRow(
-                product=line.description,
-                quantity=line.quantity,
-                tax_percent=line.tax_percent,
-                discount_percent=line.discount_percent,
+                product=description,
+                quantity=qty,
+                tax_percent=tax_percent,
+                discount_percent=discount_percent,
                 cost_bruto_unit=_money(cost_bruto_unit),
                 cost_neto_unit=_money(cost_neto_unit),
                 venta_neta_unit=_money(venta_neta_unit),
                 venta_bruta_unit=_money(venta_bruta_unit),
-                source_line_id=line.line_id,
-                supplier_reference=line.supplier_reference,
+                source_line_id=line_id,
+                supplier_reference=supplier_reference,
                 markup_percent=rule.utilidad_percent if rule else None,
             )
         )
@@ -1,16 +1,19 @@
+from concurrent.futures import ProcessPoolExecutor
 from dataclasses import dataclass, field
+from functools import lru_cache, partial
 import io
+import os
 from pathlib import Path
 import sys
 import time
-from typing import List, Optional
+from typing import Iterable, List, Optional
 import zipfile
 
 from .invoice_parser import (
     InvoiceHeader,
     extract_invoice_root_from_bytes,
     parse_invoice_header,
-    parse_invoice_lines,
+    parse_invoice_line_batch,
 )
 from .pricing import MarkupConfig, PriceRow, build_price_rows
 from .rules import load_rules
@@ -37,24 +40,31 @@ class ProcessMetrics:
     artifact_ms: float = 0.0
 
 
-def _safe_name(value: str) -> str:
-    if not value:
-        return "Factura"
-    invalid = '<>:"/\\\\|?*'
-    cleaned = "".join("_" if ch in invalid or ord(ch) < 32 else ch for ch in value)
-    cleaned = cleaned.strip().strip(".")
-    return cleaned or "Factura"
+# Caracteres no validos en nombres de archivo (y de control < 32) se reemplazan por "_".
+_SAFE_NAME_TABLE = {code: "_" for code in range(32)}
+_SAFE_NAME_TABLE.update({ord(ch): "_" for ch in '<>:"/\\|?*'})
+
+
+def _safe_name(value: str, fallback: str = "Factura") -> str:
+    cleaned = (value or "").translate(_SAFE_NAME_TABLE).strip().strip(".")
+    return cleaned or fallback
 
 
 def _load_from_zip_stream(stream: io.BytesIO):
     with zipfile.ZipFile(stream, "r") as zf:
-        xml_entries = [info for info in zf.infolist() if not info.is_dir() and info.filename.lower().endswith(".xml")]
+        xml_entries = []
+        pdf_info = None
+        for info in zf.infolist():
+            if info.is_dir():
+                continue
+            lower_name = info.filename.lower()
+            if lower_name.endswith(".xml"):
+                xml_entries.append(info)
+            elif pdf_info is None and lower_name.endswith(".pdf"):
+                pdf_info = info
         if not xml_entries:
             raise FileNotFoundError("No se encontro ningun XML dentro del ZIP.")
 
-        pdf_entries = [info for info in zf.infolist() if not info.is_dir() and info.filename.lower().endswith(".pdf")]
-        pdf_info = pdf_entries[0] if pdf_entries else None
-
         last_error = None
         for info in xml_entries:
             try:
@@ -78,6 +88,7 @@ def load_invoice_root_bytes(input_name: str, input_bytes: bytes):
     return _load_from_zip_stream(io.BytesIO(input_bytes))
 
 
+@lru_cache(maxsize=1)
 def _default_rules_path() -> Path:
     if getattr(sys, "frozen", False):
         base = Path(sys.executable).resolve().parent
@@ -96,45 +107,37 @@ def _write_invoice_artifacts(
     pdf_bytes: Optional[bytes],
     pdf_name: Optional[str],
     invoice_ref: str,
+    excel_engine: str = "xlsxwriter",
 ) -> tuple[Path, bool]:
-    if input_name.lower().endswith(".zip"):
-        if output_path is None:
-            base_dir = Path.cwd()
-        else:
-            base_dir = output_path if output_path.suffix.lower() != ".xlsx" else output_path.parent
-        target_dir = base_dir / invoice_ref
-        target_dir.mkdir(parents=True, exist_ok=True)
-
-        excel_path = target_dir / f"{invoice_ref}.xlsx"
-        skipped_existing = False
-        if excel_path.exists():
-            skipped_existing = True
-        else:
-            export_price_rows(price_rows, excel_path, sheet_name=sheet_name, header=header, config=config)
-
-        if pdf_bytes and pdf_name:
-            pdf_path = target_dir / _safe_name(Path(pdf_name).name)
-            if not pdf_path.exists():
-                pdf_path.write_bytes(pdf_bytes)
-
-        return target_dir, skipped_existing
-
+    is_zip = input_name.lower().endswith(".zip")
     if output_path is None:
-        raise ValueError("output_path es obligatorio para XML directo.")
+        if not is_zip:
+            raise ValueError("output_path es obligatorio para XML directo.")
+        output_path = Path.cwd()
+    is_xlsx_target = output_path.suffix.lower() == ".xlsx"
+
+    if is_xlsx_target and not is_zip:
+        # XML directo hacia un .xlsx explicito: no se crea carpeta por factura.
+        excel_path = result_path = output_path
+    else:
+        base_dir = output_path.parent if is_xlsx_target else output_path
+        result_path = base_dir / invoice_ref
+        result_path.mkdir(parents=True, exist_ok=True)
+        excel_path = result_path / f"{invoice_ref}.xlsx"
 
-    if output_path.suffix.lower() == ".xlsx":
-        if output_path.exists():
-            return output_path, True
-        export_price_rows(price_rows, output_path, sheet_name=sheet_name, header=header, config=config)
-        return output_path, False
+    skipped_existing = excel_path.exists()
+    if not skipped_existing:
+        export_price_rows(price_rows, excel_path, sheet_name=sheet_name, header=header, config=config, engine=excel_engine)
 
-    target_dir = output_path / invoice_ref
-    target_dir.mkdir(parents=True, exist_ok=True)
-    excel_path = target_dir / f"{invoice_ref}.xlsx"
-    if excel_path.exists():
-        return target_dir, True
-    export_price_rows(price_rows, excel_path, sheet_name=sheet_name, header=header, config=config)
-    return target_dir, False
+    if is_zip and pdf_bytes and pdf_name:
+        # Modo "x": crea el PDF solo si no existe, sin un stat previo.
+        try:
+            with open(result_path / _safe_name(Path(pdf_name).name), "xb") as handle:
+                handle.write(pdf_bytes)
+        except FileExistsError:
+            pass
+
+    return result_path, skipped_existing
 
 
 def process_invoice_bytes(
@@ -145,10 +148,11 @@ def process_invoice_bytes(
     sheet_name: str = "Productos",
     rules_path: Optional[Path] = None,
     generate_output: bool = True,
+    excel_engine: str = "xlsxwriter",
 ) -> ProcessResult:
     parse_started = time.perf_counter()
     invoice_root, xml_name, pdf_name, pdf_bytes, raw_xml_bytes = load_invoice_root_bytes(input_name, input_bytes)
-    invoice_lines = parse_invoice_lines(invoice_root)
+    invoice_lines = parse_invoice_line_batch(invoice_root)
     invoice_header = parse_invoice_header(invoice_root)
     parse_ms = (time.perf_counter() - parse_started) * 1000
 
@@ -157,6 +161,8 @@ def process_invoice_bytes(
     rules = load_rules(rules_file) if rules_file else []
     price_rows = build_price_rows(invoice_lines, config, rules=rules)
     pricing_ms = (time.perf_counter() - pricing_started) * 1000
+    # El arbol XML y las columnas de lineas ya no se usan: se liberan antes de escribir el Excel.
+    del invoice_root, invoice_lines
 
     invoice_ref = _safe_name(invoice_header.invoice_id) if invoice_header.invoice_id else _safe_name(Path(xml_name).stem)
     metrics = ProcessMetrics(parse_ms=parse_ms, pricing_ms=pricing_ms)
@@ -187,6 +193,7 @@ def process_invoice_bytes(
         pdf_bytes=pdf_bytes,
         pdf_name=pdf_name,
         invoice_ref=invoice_ref,
+        excel_engine=excel_engine,
     )
     result.output_path = resolved_output_path
     result.skipped_existing = skipped_existing
@@ -200,13 +207,12 @@ def process_invoice(
     config: MarkupConfig,
     sheet_name: str = "Productos",
     rules_path: Optional[Path] = None,
+    excel_engine: str = "xlsxwriter",
 ) -> ProcessResult:
     resolved_output = output_path
-    if input_path.suffix.lower() != ".zip" and resolved_output is None:
-        resolved_output = input_path.with_suffix(".xlsx")
-
-    if input_path.suffix.lower() == ".zip" and resolved_output is None:
-        resolved_output = input_path.parent
+    if resolved_output is None:
+        is_zip = input_path.suffix.lower() == ".zip"
+        resolved_output = input_path.parent if is_zip else input_path.with_suffix(".xlsx")
 
     return process_invoice_bytes(
         input_name=input_path.name,
@@ -216,4 +222,40 @@ def process_invoice(
         sheet_name=sheet_name,
         rules_path=rules_path,
         generate_output=True,
+        excel_engine=excel_engine,
+    )
+
+
+def process_invoices(
+    input_paths: Iterable[Path],
+    output_path: Optional[Path],
+    config: MarkupConfig,
+    sheet_name: str = "Productos",
+    rules_path: Optional[Path] = None,
+    excel_engine: str = "xlsxwriter",
+    max_workers: Optional[int] = None,
+) -> List[ProcessResult]:
+    """
+    Procesa varias facturas en paralelo con procesos (parseo, precios y Excel son CPU).
+    Devuelve los resultados en el mismo orden de `input_paths`.
+    """
+    paths = list(input_paths)
+    if output_path is not None and output_path.suffix.lower() == ".xlsx" and len(paths) > 1:
+        # Todos los procesos escribirian el mismo archivo; con varias facturas la salida es una carpeta.
+        raise ValueError("Con varias facturas output_path debe ser una carpeta, no un archivo .xlsx.")
+    worker = partial(
+        process_invoice,
+        output_path=output_path,
+        config=config,
+        sheet_name=sheet_name,
+        rules_path=rules_path,
+        excel_engine=excel_engine,
     )
+    workers = min(max_workers or os.cpu_count() or 1, len(paths))
+    if workers <= 1:
+        return [worker(path) for path in paths]
+
+    # Bloques de varias facturas por envio para amortizar el pickling, sin dejar procesos ociosos.
+    chunksize = max(1, len(paths) // (workers * 4))
+    with ProcessPoolExecutor(max_workers=workers) as executor:
+        return list(executor.map(worker, paths, chunksize=chunksize))
@@ -1,8 +1,9 @@
-from dataclasses import dataclass
+from dataclasses import dataclass, field
 from decimal import Decimal
 from pathlib import Path
-from typing import List, Optional
+from typing import List, Optional, Union
 from functools import lru_cache
+import os
 import re
 
 from openpyxl import load_workbook
@@ -13,68 +14,128 @@ class PricingRule:
     match_type: str
     pattern: str
     utilidad_percent: Optional[Decimal]
+    # Derivados del patron, calculados una sola vez y no por cada linea de factura.
+    pattern_lower: str = field(init=False, repr=False, compare=False)
+    compiled_regex: Optional[re.Pattern] = field(init=False, repr=False, compare=False)
+
+    def __post_init__(self) -> None:
+        self.pattern_lower = self.pattern.lower()
+        self.compiled_regex = None
+        if self.match_type == "regex":
+            try:
+                self.compiled_regex = re.compile(self.pattern, re.IGNORECASE)
+            except re.error:
+                # Regex invalida: la regla nunca coincide.
+                pass
 
 
 def _normalize_header(value: str) -> str:
     return "".join(ch for ch in value.lower() if ch.isalnum())
 
 
+def _row_value(row: tuple, idx: int):
+    # En modo solo lectura las filas pueden venir mas cortas que el encabezado.
+    return row[idx] if idx < len(row) else None
+
+
 @lru_cache(maxsize=8)
 def _load_rules_cached(path_str: str, mtime_ns: int) -> tuple[PricingRule, ...]:
     path = Path(path_str)
     if not path.exists():
         return ()
-    wb = load_workbook(path, data_only=True)
-    ws = wb.active
-
-    header = [cell.value or "" for cell in next(ws.iter_rows(min_row=1, max_row=1))]
-    header_map = {}
-    for idx, name in enumerate(header):
-        key = _normalize_header(str(name))
-        if key in {"matchtype", "tipo"}:
-            header_map["match_type"] = idx
-        elif key in {"pattern", "patron"}:
-            header_map["pattern"] = idx
-        elif key in {"utilidadpercent", "utilidad", "markuppercent", "markup"}:
-            header_map["utilidad_percent"] = idx
-
-    rules: List[PricingRule] = []
-    for row in ws.iter_rows(min_row=2, values_only=True):
-        if not any(row):
-            continue
-        match_type = str(row[header_map.get("match_type", 0)] or "contains").strip().lower()
-        pattern = str(row[header_map.get("pattern", 1)] or "").strip()
-        utilidad_raw = row[header_map.get("utilidad_percent", 2)] if "utilidad_percent" in header_map else None
-        utilidad = Decimal(str(utilidad_raw)) if utilidad_raw not in (None, "") else None
-        if not pattern:
-            continue
-        rules.append(PricingRule(match_type=match_type, pattern=pattern, utilidad_percent=utilidad))
+    # Solo lectura: openpyxl recorre sheetData en streaming sin construir objetos Cell.
+    wb = load_workbook(path, data_only=True, read_only=True)
+    try:
+        ws = wb.active
+        rows = ws.iter_rows(values_only=True)
+        header = [value or "" for value in next(rows, ())]
+        header_map = {}
+        for idx, name in enumerate(header):
+            key = _normalize_header(str(name))
+            if key in {"matchtype", "tipo"}:
+                header_map["match_type"] = idx
+            elif key in {"pattern", "patron"}:
+                header_map["pattern"] = idx
+            elif key in {"utilidadpercent", "utilidad", "markuppercent", "markup"}:
+                header_map["utilidad_percent"] = idx
+
+        rules: List[PricingRule] = []
+        for row in rows:
+            if not any(row):
+                continue
+            match_type = str(_row_value(row, header_map.get("match_type", 0)) or "contains").strip().lower()
+            pattern = str(_row_value(row, header_map.get("pattern", 1)) or "").strip()
+            utilidad_raw = _row_value(row, header_map["utilidad_percent"]) if "utilidad_percent" in header_map else None
+            utilidad = Decimal(str(utilidad_raw)) if utilidad_raw not in (None, "") else None
+            if not pattern:
+                continue
+            rules.append(PricingRule(match_type=match_type, pattern=pattern, utilidad_percent=utilidad))
+    finally:
+        wb.close()
     return tuple(rules)
 
 
 def load_rules(path: Path) -> List[PricingRule]:
-    if not path.exists():
+    # Un solo stat por llamada: la cache depende de la ruta absoluta y del mtime del archivo.
+    try:
+        stat = path.stat()
+    except OSError:
         return []
-    stat = path.stat()
-    return list(_load_rules_cached(str(path.resolve()), stat.st_mtime_ns))
+    return list(_load_rules_cached(os.path.abspath(path), stat.st_mtime_ns))
 
 
-def find_rule(description: str, rules: List[PricingRule]) -> Optional[PricingRule]:
+@dataclass
+class RulesIndex:
+    """
+    Reglas agrupadas por tipo de coincidencia, conservando su posicion en la hoja.
+    Gana la primera regla de la hoja que coincida, igual que un recorrido lineal.
+    """
+
+    exact: dict[str, tuple[int, PricingRule]]
+    startswith: list[tuple[int, str, PricingRule]]
+    contains: list[tuple[int, str, PricingRule]]
+    regex: list[tuple[int, re.Pattern, PricingRule]]
+
+    @classmethod
+    def from_rules(cls, rules: List[PricingRule]) -> "RulesIndex":
+        index = cls(exact={}, startswith=[], contains=[], regex=[])
+        for position, rule in enumerate(rules):
+            match_type = rule.match_type
+            if match_type == "exact":
+                index.exact.setdefault(rule.pattern_lower, (position, rule))
+            elif match_type == "startswith":
+                index.startswith.append((position, rule.pattern_lower, rule))
+            elif match_type == "regex":
+                if rule.compiled_regex is not None:
+                    index.regex.append((position, rule.compiled_regex, rule))
+            elif match_type in ("contains", "contiene"):
+                index.contains.append((position, rule.pattern_lower, rule))
+        return index
+
+
+def find_rule(description: str, rules: Union[RulesIndex, List[PricingRule]]) -> Optional[PricingRule]:
     if not description:
         return None
+    index = rules if isinstance(rules, RulesIndex) else RulesIndex.from_rules(rules)
     text = description.lower()
-    for rule in rules:
-        pattern = rule.pattern.lower()
-        if rule.match_type == "exact" and text == pattern:
-            return rule
-        if rule.match_type == "startswith" and text.startswith(pattern):
-            return rule
-        if rule.match_type == "regex":
-            try:
-                if re.search(rule.pattern, description, re.IGNORECASE):
-                    return rule
-            except re.error:
-                continue
-        if rule.match_type in ("contains", "contiene") and pattern in text:
-            return rule
-    return None
+    best = index.exact.get(text)
+    # Cada grupo esta en orden de hoja: se corta al pasar la mejor posicion ya encontrada.
+    for position, pattern, rule in index.startswith:
+        if best is not None and position > best[0]:
+            break
+        if text.startswith(pattern):
+            best = (position, rule)
+            break
+    for position, pattern, rule in index.contains:
+        if best is not None and position > best[0]:
+            break
+        if pattern in text:
+            best = (position, rule)
+            break
+    for position, compiled, rule in index.regex:
+        if best is not None and position > best[0]:
+            break
+        if compiled.search(description):
+            best = (position, rule)
+            break
+    return best[1] if best is not None else None
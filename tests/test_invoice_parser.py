@@ -0,0 +1,130 @@
+import sys
+import tempfile
+import unittest
+from decimal import Decimal
+from pathlib import Path
+
+ROOT = Path(__file__).resolve().parents[1]
+SRC = ROOT / "src"
+if str(SRC) not in sys.path:
+    sys.path.insert(0, str(SRC))
+
+from facturador.invoice_parser import (
+    extract_invoice_root,
+    extract_invoice_root_from_bytes,
+    parse_invoice_header,
+    parse_invoice_line_batch,
+)
+
+UBL_NS = (
+    'xmlns:cac="urn:oasis:names:specification:ubl:schema:xsd:CommonAggregateComponents-2" '
+    'xmlns:cbc="urn:oasis:names:specification:ubl:schema:xsd:CommonBasicComponents-2"'
+)
+
+
+def invoice_xml(root="Invoice", invoice_id="FE-25", line_count=2):
+    line_tag = "InvoiceLine" if root == "Invoice" else "CreditNoteLine"
+    quantity_tag = "InvoicedQuantity" if root == "Invoice" else "CreditedQuantity"
+    lines = "".join(
+        f"<cac:{line_tag}><cbc:ID>{idx}</cbc:ID>"
+        f'<cbc:{quantity_tag} unitCode="EA">2</cbc:{quantity_tag}>'
+        f'<cbc:LineExtensionAmount currencyID="COP">{idx}000.00</cbc:LineExtensionAmount>'
+        "<cac:TaxTotal><cac:TaxSubtotal><cac:TaxCategory><cbc:Percent>19.00</cbc:Percent>"
+        "</cac:TaxCategory></cac:TaxSubtotal></cac:TaxTotal>"
+        f"<cac:Item><cbc:Description>Tornillo tamaño {idx}</cbc:Description></cac:Item>"
+        f"</cac:{line_tag}>"
+        for idx in range(1, line_count + 1)
+    )
+    return (
+        '<?xml version="1.0" encoding="UTF-8"?>'
+        f'<{root} xmlns="urn:oasis:names:specification:ubl:schema:xsd:{root}-2" {UBL_NS}>'
+        f"<cbc:ID>{invoice_id}</cbc:ID><cbc:UUID>cufe-{invoice_id}</cbc:UUID>"
+        "<cbc:Note>Ver &lt;Invoice&gt; adjunta</cbc:Note>"
+        "<cac:AccountingSupplierParty><cac:Party><cac:PartyTaxScheme>"
+        "<cbc:RegistrationName>FERRETERIA ÑANDÚ SAS</cbc:RegistrationName><cbc:CompanyID>900123</cbc:CompanyID>"
+        "</cac:PartyTaxScheme></cac:Party></cac:AccountingSupplierParty>"
+        f"{lines}</{root}>"
+    )
+
+
+def attached_document_xml(*descriptions):
+    attachments = "".join(
+        "<cac:Attachment><cac:ExternalReference><cbc:MimeCode>text/xml</cbc:MimeCode>"
+        f"<cbc:Description><![CDATA[{description}]]></cbc:Description>"
+        "</cac:ExternalReference></cac:Attachment>"
+        for description in descriptions
+    )
+    return (
+        '<?xml version="1.0" encoding="UTF-8"?>'
+        f'<AttachedDocument xmlns="urn:oasis:names:specification:ubl:schema:xsd:AttachedDocument-2" {UBL_NS}>'
+        "<cbc:ID>AD-1</cbc:ID>"
+        # Description fuera de un Attachment: no debe tomarse aunque mencione <Invoice.
+        "<cac:SenderParty><cbc:Description><![CDATA[<Invoice>texto libre</Invoice>]]></cbc:Description>"
+        "</cac:SenderParty>"
+        f"{attachments}</AttachedDocument>"
+    )
+
+
+class ExtractInvoiceRootTest(unittest.TestCase):
+    def test_attached_document_returns_embedded_cdata_invoice(self):
+        data = attached_document_xml("sin factura", invoice_xml(), invoice_xml(invoice_id="FE-OTRA")).encode("utf-8")
+
+        root = extract_invoice_root_from_bytes(data)
+
+        self.assertEqual(root.tag, "{urn:oasis:names:specification:ubl:schema:xsd:Invoice-2}Invoice")
+        header = parse_invoice_header(root)
+        self.assertEqual(header.invoice_id, "FE-25")
+        self.assertEqual(header.supplier_name, "FERRETERIA ÑANDÚ SAS")
+        batch = parse_invoice_line_batch(root)
+        self.assertEqual(len(batch), 2)
+        self.assertEqual(batch[1].description, "Tornillo tamaño 2")
+
+    def test_attached_document_with_credit_note(self):
+        data = attached_document_xml(invoice_xml(root="CreditNote", invoice_id="NC-7")).encode("utf-8")
+
+        root = extract_invoice_root_from_bytes(data)
+
+        header = parse_invoice_header(root)
+        self.assertEqual(header.document_kind, "PURCHASE_CREDIT_NOTE")
+        self.assertEqual(header.invoice_id, "NC-7")
+        self.assertEqual(parse_invoice_line_batch(root)[0].quantity, Decimal("2"))
+
+    def test_root_invoice_is_parsed_complete(self):
+        # Con la raiz Invoice se rebobina y se parsea el documento completo, no el arbol parcial.
+        data = invoice_xml(line_count=30).encode("utf-8")
+
+        root = extract_invoice_root_from_bytes(data)
+
+        self.assertEqual(parse_invoice_header(root).invoice_id, "FE-25")
+        batch = parse_invoice_line_batch(root)
+        self.assertEqual(len(batch), 30)
+        self.assertEqual(batch[29].line_extension_amount, Decimal("30000.00"))
+
+    def test_root_invoice_from_file(self):
+        with tempfile.TemporaryDirectory() as tmp_dir:
+            path = Path(tmp_dir) / "factura.xml"
+            path.write_bytes(invoice_xml(root="CreditNote", invoice_id="NC-1").encode("utf-8"))
+
+            root = extract_invoice_root(str(path))
+
+        self.assertEqual(parse_invoice_header(root).document_kind, "PURCHASE_CREDIT_NOTE")
+        self.assertEqual(len(parse_invoice_line_batch(root)), 2)
+
+    def test_attached_document_from_file(self):
+        with tempfile.TemporaryDirectory() as tmp_dir:
+            path = Path(tmp_dir) / "attached.xml"
+            path.write_bytes(attached_document_xml(invoice_xml(invoice_id="FE-99")).encode("utf-8"))
+
+            root = extract_invoice_root(str(path))
+
+        self.assertEqual(parse_invoice_header(root).invoice_id, "FE-99")
+
+    def test_attached_document_without_invoice_raises(self):
+        data = attached_document_xml("<Otro>sin factura</Otro>", "<Invoice sin cerrar").encode("utf-8")
+
+        with self.assertRaises(ValueError):
+            extract_invoice_root_from_bytes(data)
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,290 @@
+import base64
+import binascii
+import os
+import sys
+import tempfile
+import threading
+import unittest
+from pathlib import Path
+from types import SimpleNamespace
+from unittest.mock import MagicMock, patch
+
+import urllib3
+
+ROOT = Path(__file__).resolve().parents[1]
+SRC = ROOT / "src"
+if str(SRC) not in sys.path:
+    sys.path.insert(0, str(SRC))
+
+from facturador import mail_automation
+from facturador.mail_automation import (
+    GMAIL_MESSAGE_FIELDS,
+    GMAIL_MESSAGE_PART_DEPTH,
+    AutomationError,
+    MailAutomationService,
+    _decode_base64url,
+    _erp_http_pool,
+    _erp_pool_for_proxy,
+)
+
+
+def encode(data: bytes) -> str:
+    return base64.urlsafe_b64encode(data).decode("ascii")
+
+
+class DecodeBase64UrlTest(unittest.TestCase):
+    def setUp(self):
+        # Bytes altos generan '-' y '_' en base64url.
+        self.payloads = [os.urandom(size) + b"\xfb\xff\xfe" for size in (6, 7, 8, 40, 41, 42, 100)]
+
+    def test_small_chunks_match_single_decode_for_every_padding(self):
+        with patch.object(mail_automation, "_BASE64_CHUNK_CHARS", 8):
+            for data in self.payloads:
+                encoded = encode(data)
+                with self.subTest(length=len(encoded), padding=encoded.count("=")):
+                    self.assertGreater(len(encoded), 8)
+                    self.assertEqual(_decode_base64url(encoded), data)
+
+    def test_input_exactly_one_chunk_plus_padding_group(self):
+        with patch.object(mail_automation, "_BASE64_CHUNK_CHARS", 8):
+            for data in (b"abcdefg", b"abcdefgh", b"abcdefghi"):
+                encoded = encode(data)
+                with self.subTest(encoded=encoded):
+                    self.assertEqual(_decode_base64url(encoded), data)
+
+    def test_misaligned_text_falls_back_to_full_decode(self):
+        data = os.urandom(300)
+        encoded = encode(data)
+        # Saltos de linea desplazan los bloques; urlsafe_b64decode los ignora sobre el texto completo.
+        wrapped = "\n".join(encoded[start : start + 76] for start in range(0, len(encoded), 76))
+        with patch.object(mail_automation, "_BASE64_CHUNK_CHARS", 16):
+            self.assertEqual(_decode_base64url(wrapped), data)
+
+    def test_missing_padding_raises_like_single_decode(self):
+        encoded = encode(os.urandom(41)).rstrip("=")
+        with patch.object(mail_automation, "_BASE64_CHUNK_CHARS", 8):
+            with self.assertRaises(binascii.Error):
+                _decode_base64url(encoded)
+        with self.assertRaises(binascii.Error):
+            base64.urlsafe_b64decode(encoded)
+
+    def test_real_chunk_size_with_multiple_chunks(self):
+        chunk_bytes = mail_automation._BASE64_CHUNK_CHARS // 4 * 3
+        for extra in (0, 1, 2):
+            data = os.urandom(chunk_bytes * 2 + extra)
+            encoded = encode(data)
+            with self.subTest(padding=encoded.count("=")):
+                self.assertGreater(len(encoded), mail_automation._BASE64_CHUNK_CHARS)
+                self.assertEqual(_decode_base64url(encoded), data)
+
+
+class FakeResponse:
+    def __init__(self, status, location=None, data=b""):
+        self.status = status
+        self.headers = {"Location": location} if location else {}
+        self.data = data
+
+
+class FakePool:
+    def __init__(self, responses):
+        self.responses = list(responses)
+        self.calls = []
+
+    def request(self, method, url, body=None, headers=None, **kwargs):
+        self.calls.append({"method": method, "url": url, "body": body, "headers": dict(headers or {})})
+        return self.responses.pop(0) if len(self.responses) > 1 else self.responses[0]
+
+
+def nested_message(depth, leaf):
+    """
+    Mensaje con `leaf` como unica parte hoja, anidada `depth` niveles bajo el payload.
+    """
+    part = leaf
+    for level in range(depth - 1, 0, -1):
+        part = {"filename": "", "body": {}, "parts": [part], "partId": f"nivel-{level}"}
+    return {"id": "msg-1", "payload": {"headers": [], "filename": "", "body": {}, "parts": [part]}}
+
+
+class DownloadMessageTest(unittest.TestCase):
+    def build_service(self, full_message=None, attachment_data=None):
+        service = MailAutomationService.__new__(MailAutomationService)
+        service.gmail = MagicMock()
+        messages = service.gmail.users.return_value.messages.return_value
+        messages.get.return_value.execute.return_value = full_message
+        messages.attachments.return_value.get.return_value.execute.return_value = {"data": attachment_data}
+        return service, messages
+
+    def full_get_calls(self, messages):
+        return [call for call in messages.get.call_args_list if "fields" not in call.kwargs]
+
+    def test_fields_mask_covers_configured_depth_and_marks_truncation(self):
+        self.assertEqual(GMAIL_MESSAGE_FIELDS.count("parts("), GMAIL_MESSAGE_PART_DEPTH)
+        self.assertTrue(GMAIL_MESSAGE_FIELDS.endswith("parts/partId" + ")" * (GMAIL_MESSAGE_PART_DEPTH + 1)))
+
+    def test_zip_deeper_than_mask_triggers_full_refetch(self):
+        zip_bytes = b"PK\x03\x04zip-profundo"
+        zip_part = {"filename": "factura.zip", "body": {"data": encode(zip_bytes)}}
+        full_message = nested_message(GMAIL_MESSAGE_PART_DEPTH + 2, zip_part)
+        # La respuesta parcial corta el arbol: del nivel siguiente al ultimo pedido solo llega partId.
+        partial = nested_message(GMAIL_MESSAGE_PART_DEPTH + 1, {"partId": "cortado"})
+        service, messages = self.build_service(full_message=full_message)
+
+        downloaded = service._download_message("msg-1", operation="gmail.messages.get", prefetched=partial)
+
+        self.assertEqual(len(self.full_get_calls(messages)), 1)
+        self.assertEqual(downloaded.attachments, [("factura.zip", zip_bytes)])
+
+    def test_zip_within_mask_depth_uses_partial_response(self):
+        zip_bytes = b"PK\x03\x04zip"
+        zip_part = {"filename": "factura.zip", "body": {"attachmentId": "adj-1"}}
+        partial = nested_message(GMAIL_MESSAGE_PART_DEPTH, zip_part)
+        service, messages = self.build_service(attachment_data=encode(zip_bytes))
+
+        downloaded = service._download_message("msg-1", operation="gmail.messages.get", prefetched=partial)
+
+        self.assertEqual(self.full_get_calls(messages), [])
+        self.assertEqual(downloaded.attachments, [("factura.zip", zip_bytes)])
+
+
+class DriveUploadPoolTest(unittest.TestCase):
+    def build_service(self):
+        service = MailAutomationService.__new__(MailAutomationService)
+        service.config = SimpleNamespace(drive_parent_folder_id="padre")
+        service.google_credentials = MagicMock()
+        service._drive_lock = threading.RLock()
+        service._thread_http = threading.local()
+        service._drive_upload_executor = None
+        service._ensure_drive_folder = MagicMock(return_value="carpeta-id")
+        service._list_drive_folder_file_names = MagicMock(side_effect=lambda folder_id: set())
+        self.addCleanup(lambda: service._drive_upload_executor and service._drive_upload_executor.shutdown())
+        return service
+
+    def test_http_per_thread_survives_between_syncs(self):
+        service = self.build_service()
+        used_http = []
+        barrier = threading.Barrier(mail_automation.DRIVE_UPLOAD_WORKERS, timeout=5)
+
+        def upload(local_file, folder_id):
+            # La barrera obliga a usar todos los hilos del pool en cada sincronizacion.
+            barrier.wait()
+            used_http.append(service._thread_drive_http())
+
+        service._upload_drive_file = upload
+        with tempfile.TemporaryDirectory() as tmp:
+            folder = Path(tmp) / "FE-1"
+            folder.mkdir()
+            for index in range(mail_automation.DRIVE_UPLOAD_WORKERS):
+                (folder / f"archivo-{index}.pdf").write_bytes(b"pdf")
+
+            service._sync_folder_to_drive(folder)
+            first_sync = set(map(id, used_http))
+            service._sync_folder_to_drive(folder)
+
+        self.assertEqual(len(first_sync), mail_automation.DRIVE_UPLOAD_WORKERS)
+        self.assertEqual(set(map(id, used_http)), first_sync)
+
+
+class ErpRequestTest(unittest.TestCase):
+    def build_service(self):
+        service = MailAutomationService.__new__(MailAutomationService)
+        service.config = SimpleNamespace(erp_base_url="https://erp.example.com/", erp_api_key="clave")
+        return service
+
+    def send(self, pool):
+        with patch.object(mail_automation, "_erp_http_pool", return_value=pool):
+            return self.build_service()._send_payload_to_erp({"invoice": "FE-1"}, invoice_ref="FE-1")
+
+    def test_post_without_redirect(self):
+        pool = FakePool([FakeResponse(201, data=b'{"ok": true}')])
+
+        status, body, _ = self.send(pool)
+
+        self.assertEqual((status, body), (201, '{"ok": true}'))
+        self.assertEqual(len(pool.calls), 1)
+        self.assertEqual(pool.calls[0]["method"], "POST")
+        self.assertEqual(pool.calls[0]["url"], "https://erp.example.com/api/purchases/ingest")
+        self.assertEqual(pool.calls[0]["headers"]["X-API-Key"], "clave")
+
+    def test_301_302_303_are_repeated_as_get_without_body(self):
+        for status in (301, 302, 303):
+            with self.subTest(status=status):
+                pool = FakePool([FakeResponse(status, location="/api/v2/ingest"), FakeResponse(200, data=b"ok")])
+
+                result_status, body, _ = self.send(pool)
+
+                self.assertEqual((result_status, body), (200, "ok"))
+                redirected = pool.calls[1]
+                self.assertEqual(redirected["method"], "GET")
+                self.assertEqual(redirected["url"], "https://erp.example.com/api/v2/ingest")
+                self.assertIsNone(redirected["body"])
+                self.assertNotIn("Content-Type", redirected["headers"])
+                self.assertEqual(redirected["headers"]["X-API-Key"], "clave")
+
+    def test_307_308_are_not_followed_and_raise(self):
+        for status in (307, 308):
+            with self.subTest(status=status):
+                pool = FakePool([FakeResponse(status, location="/otro", data=b"moved")])
+
+                with self.assertRaisesRegex(AutomationError, f"HTTP {status}"):
+                    self.send(pool)
+
+                self.assertEqual(len(pool.calls), 1)
+
+    def test_redirect_loop_stops_after_hop_limit(self):
+        pool = FakePool([FakeResponse(302, location="/vuelta")])
+
+        with self.assertRaisesRegex(AutomationError, "HTTP 302"):
+            self.send(pool)
+
+        self.assertEqual(len(pool.calls), mail_automation.ERP_MAX_REDIRECTS + 1)
+
+    def test_transport_error_raises_automation_error(self):
+        pool = FakePool([FakeResponse(200)])
+
+        with patch.object(pool, "request", side_effect=urllib3.exceptions.ProtocolError("sin red")):
+            with self.assertRaisesRegex(AutomationError, "ERP ingestion failed"):
+                self.send(pool)
+
+
+class ErpProxyTest(unittest.TestCase):
+    def setUp(self):
+        _erp_pool_for_proxy.cache_clear()
+        self.addCleanup(_erp_pool_for_proxy.cache_clear)
+
+    def pool_for(self, url, env):
+        with patch.dict(os.environ, env, clear=True):
+            return _erp_http_pool(url)
+
+    def test_without_proxy_env_uses_direct_pool(self):
+        pool = self.pool_for("https://erp.example.com/api", {})
+
+        self.assertNotIsInstance(pool, urllib3.ProxyManager)
+
+    def test_https_proxy_is_used_for_https_urls(self):
+        env = {"HTTPS_PROXY": "http://proxy.local:3128"}
+
+        pool = self.pool_for("https://erp.example.com/api", env)
+
+        self.assertIsInstance(pool, urllib3.ProxyManager)
+        self.assertEqual(pool.proxy.host, "proxy.local")
+        self.assertEqual(pool.proxy.port, 3128)
+        self.assertNotIsInstance(self.pool_for("http://erp.example.com/api", env), urllib3.ProxyManager)
+
+    def test_no_proxy_bypasses_proxy(self):
+        env = {"HTTPS_PROXY": "http://proxy.local:3128", "NO_PROXY": "erp.internal,.corp"}
+
+        self.assertNotIsInstance(self.pool_for("https://erp.internal/api", env), urllib3.ProxyManager)
+        self.assertNotIsInstance(self.pool_for("https://erp.sede.corp/api", env), urllib3.ProxyManager)
+        self.assertIsInstance(self.pool_for("https://erp.example.com/api", env), urllib3.ProxyManager)
+
+    def test_pool_is_shared_per_proxy(self):
+        env = {"HTTPS_PROXY": "http://proxy.local:3128"}
+
+        first = self.pool_for("https://erp.example.com/a", env)
+        second = self.pool_for("https://otro.example.com/b", env)
+
+        self.assertIs(first, second)
+
+
+if __name__ == "__main__":
+    unittest.main()
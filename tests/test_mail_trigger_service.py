@@ -1,18 +1,28 @@
+import base64
 import io
+import json
 import os
 import sys
+import tempfile
+import threading
 import unittest
 import zipfile
 from decimal import Decimal
 from pathlib import Path
-from unittest.mock import patch
+from unittest.mock import MagicMock, patch
 
 ROOT = Path(__file__).resolve().parents[1]
 SRC = ROOT / "src"
 if str(SRC) not in sys.path:
     sys.path.insert(0, str(SRC))
 
-from facturador.mail_trigger_service import create_app
+from facturador import mail_trigger_service
+from facturador.mail_trigger_service import (
+    LocalFileStateStore,
+    PushCoalescer,
+    WatchStateStore,
+    create_app,
+)
 from facturador.mail_automation import MailAutomationService
 from facturador.pricing import MarkupConfig
 from facturador.processor import process_invoice_bytes
@@ -117,6 +127,248 @@ class ProcessZipEndpointTest(unittest.TestCase):
         self.assertEqual(call["data"], b"zip-data")
 
 
+class PushCoalescerTest(unittest.TestCase):
+    def test_push_without_contention_is_processed(self):
+        coalescer = PushCoalescer(threading.Lock())
+
+        results = coalescer.run("100", lambda history_id: f"ok-{history_id}")
+
+        self.assertEqual(results, ["ok-100"])
+
+    def test_concurrent_push_is_parked_and_picked_up_by_holder(self):
+        operation_lock = threading.Lock()
+        coalescer = PushCoalescer(operation_lock)
+        processing = threading.Event()
+        release = threading.Event()
+        processed = []
+
+        def process(history_id):
+            processed.append(history_id)
+            if history_id == "100":
+                processing.set()
+                release.wait(timeout=5)
+            return history_id
+
+        holder_results = []
+        holder = threading.Thread(target=lambda: holder_results.append(coalescer.run("100", process)))
+        holder.start()
+        self.assertTrue(processing.wait(timeout=5))
+
+        # Mientras el primero tiene el lock, los siguientes quedan en cola y responden de inmediato.
+        self.assertIsNone(coalescer.run("150", process))
+        self.assertIsNone(coalescer.run("200", process))
+        release.set()
+        holder.join(timeout=5)
+
+        self.assertFalse(holder.is_alive())
+        self.assertEqual(processed, ["100", "200"])
+        self.assertEqual(holder_results, [["100", "200"]])
+        self.assertFalse(operation_lock.locked())
+
+    def test_parked_older_history_id_does_not_replace_newer(self):
+        coalescer = PushCoalescer(threading.Lock())
+        processed = []
+
+        def process(history_id):
+            processed.append(history_id)
+            if history_id == "300":
+                self.assertIsNone(coalescer.run("250", process))
+            return history_id
+
+        results = coalescer.run("300", process)
+
+        self.assertEqual(processed, ["300"])
+        self.assertEqual(results, ["300"])
+
+    def test_lock_is_released_when_processing_fails(self):
+        operation_lock = threading.Lock()
+        coalescer = PushCoalescer(operation_lock)
+
+        def process(history_id):
+            raise RuntimeError("boom")
+
+        with self.assertRaises(RuntimeError):
+            coalescer.run("100", process)
+
+        self.assertFalse(operation_lock.locked())
+
+
+    def test_drain_processes_push_parked_by_other_operation(self):
+        operation_lock = threading.Lock()
+        coalescer = PushCoalescer(operation_lock)
+        processed = []
+
+        operation_lock.acquire()
+        self.assertIsNone(coalescer.run("500", processed.append))
+        operation_lock.release()
+
+        coalescer.drain(processed.append)
+
+        self.assertEqual(processed, ["500"])
+        self.assertIsNone(coalescer.drain(processed.append))
+        self.assertEqual(processed, ["500"])
+
+    def test_failed_drain_keeps_push_pending(self):
+        operation_lock = threading.Lock()
+        coalescer = PushCoalescer(operation_lock)
+
+        operation_lock.acquire()
+        coalescer.run("600", lambda history_id: history_id)
+        operation_lock.release()
+
+        def fail(history_id):
+            raise RuntimeError("boom")
+
+        with self.assertRaises(RuntimeError):
+            coalescer.drain(fail)
+
+        self.assertEqual(coalescer.drain(lambda history_id: history_id), ["600"])
+
+
+class PushDuringAdminOperationTest(unittest.TestCase):
+    def test_push_parked_during_start_watch_is_processed_on_release(self):
+        os.environ["FACTURADOR_ADMIN_TOKEN"] = "secret"
+        app = create_app()
+        client = app.test_client()
+        push_body = {"message": {"data": base64.b64encode(b'{"historyId": "700"}').decode("ascii")}}
+        push_responses = []
+
+        def start_watch():
+            push_responses.append(client.post("/pubsub/push", json=push_body).get_json())
+            return {"ok": True}
+
+        with patch(
+            "facturador.mail_trigger_service.GmailPushProcessor.start_watch",
+            side_effect=start_watch,
+        ), patch(
+            "facturador.mail_trigger_service.GmailPushProcessor.process_push_history",
+            return_value={"mode": "history_incremental"},
+        ) as process_push_history:
+            response = client.post("/admin/start-watch", headers={"X-Facturador-Admin-Token": "secret"})
+
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(push_responses, [{"ok": True, "queued": "busy"}])
+        process_push_history.assert_called_once_with("700")
+
+
+class LocalFileStateStoreTest(unittest.TestCase):
+    def setUp(self):
+        self.tmp_dir = tempfile.TemporaryDirectory()
+        self.addCleanup(self.tmp_dir.cleanup)
+        self.path = Path(self.tmp_dir.name) / "state" / "watch_state.json"
+
+    def test_set_writes_json_and_leaves_no_tmp_file(self):
+        store = LocalFileStateStore(self.path)
+
+        store.set_last_history_id("123", watch_expiration="999")
+
+        self.assertEqual(
+            json.loads(self.path.read_text(encoding="utf-8")),
+            {"last_history_id": "123", "watch_expiration": "999"},
+        )
+        self.assertEqual(list(self.path.parent.iterdir()), [self.path])
+
+    def test_state_is_kept_in_memory_until_reload(self):
+        self.path.parent.mkdir(parents=True)
+        self.path.write_text(json.dumps({"last_history_id": "10"}), encoding="utf-8")
+        store = LocalFileStateStore(self.path)
+        self.assertEqual(store.get_last_history_id(), "10")
+
+        self.path.write_text(json.dumps({"last_history_id": "20"}), encoding="utf-8")
+        self.assertEqual(store.get_last_history_id(), "10")
+
+        store.reload()
+        self.assertEqual(store.get_last_history_id(), "20")
+
+    def test_read_state_returns_a_copy(self):
+        store = LocalFileStateStore(self.path)
+        store.set_last_history_id("5")
+
+        store.read_state()["last_history_id"] = "changed"
+
+        self.assertEqual(store.get_last_history_id(), "5")
+
+    def test_failed_replace_keeps_previous_file_and_memory(self):
+        store = LocalFileStateStore(self.path)
+        store.set_last_history_id("1")
+
+        with patch.object(Path, "replace", side_effect=OSError("disk full")):
+            with self.assertRaises(OSError):
+                store.set_last_history_id("2")
+
+        self.assertEqual(json.loads(self.path.read_text(encoding="utf-8"))["last_history_id"], "1")
+        self.assertEqual(store.get_last_history_id(), "1")
+
+    def test_invalid_file_is_treated_as_empty_state(self):
+        self.path.parent.mkdir(parents=True)
+        self.path.write_text("{no es json", encoding="utf-8")
+
+        store = LocalFileStateStore(self.path)
+
+        self.assertIsNone(store.get_last_history_id())
+        self.assertEqual(store.read_state(), {})
+
+
+class WatchStateStoreTest(unittest.TestCase):
+    def build_store(self, history_id="100"):
+        snapshot = MagicMock(exists=True)
+        snapshot.to_dict.return_value = {"last_history_id": history_id}
+        client = MagicMock()
+        doc_ref = client.collection.return_value.document.return_value
+        doc_ref.get.return_value = snapshot
+        with patch.object(mail_trigger_service, "_firestore_client", return_value=client):
+            store = WatchStateStore("project", "watch", "state")
+        return store, doc_ref, snapshot
+
+    def test_history_id_is_cached_within_ttl(self):
+        store, doc_ref, _ = self.build_store()
+
+        self.assertEqual(store.get_last_history_id(), "100")
+        self.assertEqual(store.get_last_history_id(), "100")
+
+        self.assertEqual(doc_ref.get.call_count, 1)
+
+    def test_force_refresh_reads_firestore(self):
+        store, doc_ref, snapshot = self.build_store()
+        store.get_last_history_id()
+
+        snapshot.to_dict.return_value = {"last_history_id": "200"}
+
+        self.assertEqual(store.get_last_history_id(), "100")
+        self.assertEqual(store.get_last_history_id(force_refresh=True), "200")
+        self.assertEqual(doc_ref.get.call_count, 2)
+
+    def test_cache_expires_after_ttl(self):
+        store, doc_ref, snapshot = self.build_store()
+        with patch.object(mail_trigger_service.time, "monotonic", return_value=1000.0):
+            store.get_last_history_id()
+
+        snapshot.to_dict.return_value = {"last_history_id": "300"}
+        expired = 1000.0 + mail_trigger_service.WATCH_STATE_CACHE_TTL_SEC + 1
+        with patch.object(mail_trigger_service.time, "monotonic", return_value=expired):
+            self.assertEqual(store.get_last_history_id(), "300")
+
+        self.assertEqual(doc_ref.get.call_count, 2)
+
+    def test_set_updates_cache_without_reading(self):
+        store, doc_ref, _ = self.build_store()
+
+        store.set_last_history_id("400")
+
+        self.assertEqual(store.get_last_history_id(), "400")
+        doc_ref.get.assert_not_called()
+        payload = doc_ref.set.call_args.args[0]
+        self.assertEqual(payload["last_history_id"], "400")
+
+    def test_missing_history_id_is_not_cached(self):
+        store, doc_ref, snapshot = self.build_store(history_id=None)
+
+        self.assertIsNone(store.get_last_history_id())
+        self.assertIsNone(store.get_last_history_id())
+
+        self.assertEqual(doc_ref.get.call_count, 2)
+
+
 class ManualZipPayloadTest(unittest.TestCase):
     def test_processes_local_zip_and_builds_erp_payload(self):
         xml_path = next((ROOT / "invoices").glob("*.xml"))
@@ -0,0 +1,52 @@
+import sys
+import unittest
+from decimal import Decimal
+from pathlib import Path
+
+ROOT = Path(__file__).resolve().parents[1]
+SRC = ROOT / "src"
+if str(SRC) not in sys.path:
+    sys.path.insert(0, str(SRC))
+
+from facturador.invoice_parser import InvoiceLine
+from facturador.pricing import MarkupConfig, build_price_rows
+
+
+def make_line(quantity, total, tax_percent, discount_percent="0"):
+    return InvoiceLine(
+        line_id="1",
+        description="PRODUCTO",
+        supplier_reference="",
+        quantity=Decimal(quantity),
+        line_extension_amount=Decimal(total),
+        tax_percent=Decimal(tax_percent),
+        base_amount=Decimal(total),
+        discount_percent=Decimal(discount_percent),
+    )
+
+
+class RoundingBoundaryTest(unittest.TestCase):
+    """
+    Costos que dan un precio de venta exacto en el multiplo del paso: deben coincidir
+    con la formula del Excel (CEILING) y no subir un paso extra por error de redondeo.
+    """
+
+    def assert_venta_neta(self, line, step, expected):
+        rows = build_price_rows([line], MarkupConfig(round_net_step=Decimal(step)))
+        self.assertEqual(rows[0].venta_neta_unit, Decimal(expected))
+
+    def test_exact_multiple_with_step_100(self):
+        # 11600 / 7 * 1.19 = 1972 y 1972 / 0.68 = 2900 exactos.
+        self.assert_venta_neta(make_line("7", "11600", "19"), "100", "2900")
+
+    def test_exact_multiple_with_step_1000(self):
+        # 10000 / 3.5 * 1.19 = 3400 y 3400 / 0.68 = 5000; el miles cerrado sube a 6000.
+        self.assert_venta_neta(make_line("3.5", "10000", "19"), "1000", "6000")
+
+    def test_exact_multiple_with_discount(self):
+        # 20000 / 7 * 0.9 * 1.19 = 3060 y 3060 / 0.68 = 4500 exactos.
+        self.assert_venta_neta(make_line("7", "20000", "19", "10"), "100", "4500")
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,79 @@
+import sys
+import tempfile
+import unittest
+from decimal import Decimal
+from pathlib import Path
+
+from openpyxl import load_workbook
+
+ROOT = Path(__file__).resolve().parents[1]
+SRC = ROOT / "src"
+if str(SRC) not in sys.path:
+    sys.path.insert(0, str(SRC))
+
+from facturador.pricing import MarkupConfig
+from facturador.processor import process_invoices
+
+
+def invoice_xml(invoice_id, quantity, total):
+    return (
+        '<?xml version="1.0" encoding="UTF-8"?>'
+        '<Invoice xmlns="urn:oasis:names:specification:ubl:schema:xsd:Invoice-2" '
+        'xmlns:cac="urn:oasis:names:specification:ubl:schema:xsd:CommonAggregateComponents-2" '
+        'xmlns:cbc="urn:oasis:names:specification:ubl:schema:xsd:CommonBasicComponents-2">'
+        f"<cbc:ID>{invoice_id}</cbc:ID>"
+        "<cac:InvoiceLine><cbc:ID>1</cbc:ID>"
+        f'<cbc:InvoicedQuantity unitCode="EA">{quantity}</cbc:InvoicedQuantity>'
+        f'<cbc:LineExtensionAmount currencyID="COP">{total}</cbc:LineExtensionAmount>'
+        "<cac:TaxTotal><cac:TaxSubtotal><cac:TaxCategory><cbc:Percent>19.00</cbc:Percent>"
+        "</cac:TaxCategory></cac:TaxSubtotal></cac:TaxTotal>"
+        f"<cac:Item><cbc:Description>Producto {invoice_id}</cbc:Description></cac:Item>"
+        "</cac:InvoiceLine></Invoice>"
+    )
+
+
+class ProcessInvoicesTest(unittest.TestCase):
+    def setUp(self):
+        self.tmp_dir = tempfile.TemporaryDirectory()
+        self.addCleanup(self.tmp_dir.cleanup)
+        self.base = Path(self.tmp_dir.name)
+        self.rules_path = self.base / "sin_reglas.xlsx"
+        self.inputs = []
+        for invoice_id, quantity, total in (("FE-1", "7", "11600"), ("FE-2", "3.5", "10000"), ("FE-3", "1", "500")):
+            path = self.base / f"{invoice_id}.xml"
+            path.write_text(invoice_xml(invoice_id, quantity, total), encoding="utf-8")
+            self.inputs.append(path)
+
+    def test_runs_inputs_through_process_pool_in_order(self):
+        results = process_invoices(
+            self.inputs,
+            None,
+            MarkupConfig(),
+            rules_path=self.rules_path,
+            max_workers=2,
+        )
+
+        self.assertEqual([result.header.invoice_id for result in results], ["FE-1", "FE-2", "FE-3"])
+        self.assertEqual(results[0].price_rows[0].venta_neta_unit, Decimal("2900.00"))
+        for path, result in zip(self.inputs, results):
+            self.assertEqual(result.output_path, path.with_suffix(".xlsx"))
+            sheet = load_workbook(result.output_path, read_only=True).worksheets[0]
+            self.assertEqual(list(sheet.iter_rows(min_row=2, max_col=2, values_only=True))[0][1], f"Producto {path.stem}")
+
+    def test_output_folder_gets_one_folder_per_invoice(self):
+        output_dir = self.base / "salida"
+
+        results = process_invoices(self.inputs[:2], output_dir, MarkupConfig(), rules_path=self.rules_path, max_workers=2)
+
+        self.assertEqual([result.output_path for result in results], [output_dir / "FE-1", output_dir / "FE-2"])
+        self.assertTrue((output_dir / "FE-2" / "FE-2.xlsx").exists())
+
+    def test_rejects_single_xlsx_output_for_several_inputs(self):
+        with self.assertRaises(ValueError):
+            process_invoices(self.inputs, self.base / "todas.xlsx", MarkupConfig(), rules_path=self.rules_path)
+
+        self.assertFalse((self.base / "todas.xlsx").exists())
+
+
+if __name__ == "__main__":
+    unittest.main()
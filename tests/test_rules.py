@@ -0,0 +1,132 @@
+import random
+import re
+import sys
+import unittest
+from decimal import Decimal
+from pathlib import Path
+
+ROOT = Path(__file__).resolve().parents[1]
+SRC = ROOT / "src"
+if str(SRC) not in sys.path:
+    sys.path.insert(0, str(SRC))
+
+from facturador.rules import PricingRule, RulesIndex, find_rule
+
+
+def linear_find_rule(description, rules):
+    """
+    Recorrido lineal original: gana la primera regla de la hoja que coincida.
+    """
+    if not description:
+        return None
+    text = description.lower()
+    for rule in rules:
+        pattern = rule.pattern.lower()
+        if rule.match_type == "exact" and text == pattern:
+            return rule
+        if rule.match_type == "startswith" and text.startswith(pattern):
+            return rule
+        if rule.match_type == "regex":
+            try:
+                if re.search(rule.pattern, description, re.IGNORECASE):
+                    return rule
+            except re.error:
+                continue
+        if rule.match_type in ("contains", "contiene") and pattern in text:
+            return rule
+    return None
+
+
+def rule(match_type, pattern, utilidad="30"):
+    return PricingRule(match_type=match_type, pattern=pattern, utilidad_percent=Decimal(utilidad))
+
+
+MIXED_RULES = [
+    rule("contains", "tornillo", "10"),
+    rule("exact", "tornillo 1/4", "20"),
+    rule("regex", r"^pintura\s+\w+", "30"),
+    rule("startswith", "pintura", "40"),
+    rule("exact", "Pintura Blanca", "50"),
+    rule("contiene", "blanca", "60"),
+    rule("regex", r"[", "70"),
+    rule("startswith", "llave", "80"),
+    rule("exact", "llave", "90"),
+    rule("regex", r"\d+/\d+", "15"),
+    rule("contains", "1/4", "25"),
+    rule("desconocido", "tuerca", "35"),
+    rule("contains", "tuerca", "45"),
+    rule("exact", "tuerca", "55"),
+]
+
+DESCRIPTIONS = [
+    "",
+    "Tornillo 1/4",
+    "tornillo 1/4",
+    "TORNILLO",
+    "Pintura Blanca",
+    "pintura",
+    "Pintura  Roja",
+    "Blanca pintura",
+    "llave",
+    "Llave inglesa 3/8",
+    "arandela 1/4",
+    "tuerca",
+    "Tuerca 1/2",
+    "Cemento gris",
+]
+
+
+class RulesIndexTest(unittest.TestCase):
+    def test_index_matches_linear_scan_for_mixed_rules(self):
+        index = RulesIndex.from_rules(MIXED_RULES)
+        for description in DESCRIPTIONS:
+            with self.subTest(description=description):
+                self.assertIs(find_rule(description, index), linear_find_rule(description, MIXED_RULES))
+
+    def test_earlier_rule_wins_over_later_overlapping_rules(self):
+        index = RulesIndex.from_rules(MIXED_RULES)
+
+        # "contains tornillo" aparece antes que "exact tornillo 1/4".
+        self.assertIs(find_rule("Tornillo 1/4", index), MIXED_RULES[0])
+        # La regex de pintura va antes que el startswith y el exact.
+        self.assertIs(find_rule("Pintura Blanca", index), MIXED_RULES[2])
+        # El startswith anterior gana sobre el exact de la misma palabra.
+        self.assertIs(find_rule("llave", index), MIXED_RULES[7])
+        # Tipos desconocidos se ignoran; el siguiente contains gana.
+        self.assertIs(find_rule("tuerca", index), MIXED_RULES[12])
+
+    def test_duplicate_exact_keeps_first_in_sheet(self):
+        rules = [rule("exact", "Cemento", "10"), rule("exact", "cemento", "20")]
+
+        self.assertIs(find_rule("CEMENTO", RulesIndex.from_rules(rules)), rules[0])
+
+    def test_invalid_regex_never_matches(self):
+        rules = [rule("regex", r"(", "10"), rule("contains", "(", "20")]
+
+        self.assertIs(find_rule("tubo (pvc)", RulesIndex.from_rules(rules)), rules[1])
+
+    def test_list_argument_matches_index(self):
+        for description in DESCRIPTIONS:
+            with self.subTest(description=description):
+                self.assertIs(find_rule(description, MIXED_RULES), linear_find_rule(description, MIXED_RULES))
+
+    def test_random_rule_sheets_match_linear_scan(self):
+        rng = random.Random(20240601)
+        words = ["tornillo", "tuerca", "pintura", "blanca", "1/4", "llave", "pvc", "tubo"]
+        match_types = ["exact", "startswith", "contains", "contiene", "regex"]
+        for _ in range(200):
+            rules = []
+            for _ in range(rng.randint(1, 12)):
+                match_type = rng.choice(match_types)
+                pattern = " ".join(rng.sample(words, rng.randint(1, 2)))
+                if match_type == "regex":
+                    pattern = rng.choice([pattern, f"^{pattern}", f"{pattern}$", r"\d"])
+                rules.append(rule(match_type, pattern))
+            index = RulesIndex.from_rules(rules)
+            for _ in range(10):
+                description = " ".join(rng.sample(words, rng.randint(1, 3))).title()
+                self.assertIs(find_rule(description, index), linear_find_rule(description, rules))
+
+
+if __name__ == "__main__":
+    unittest.main()